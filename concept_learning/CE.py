@@ -6,255 +6,262 @@ algorithm introduction
 
 Description: Candidate Elimination Algorithm
              1. We use Maximum General Member (G) and Maximum Special Member (S) to represent Version Space
+             2. a hypothesis is a row of bitmasks of the values every attribute allows, a boundary a matrix of them,
+                so covering an example, generalizing and specializing work on the whole boundary at once
+             3. a boundary holds no duplicates (hashed rows) and is indexed by the attributes its members
+                constrain, so the members of G which another member is more general than are removed
+                in about linear time
 
 """
 
 import os
+import sys
 import random
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_vocab, get_attr_heads, iter_pos_neg_data
 
-EMPTY = 'None'
-ANY = '?'
-
-
-def read_data(filename):
-    data = []
-    attr2value = {}
-    value2attr = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-                if attr not in value2attr:
-                    value2attr[attr] = head
-    return {'heads': heads, 'data': data, 'attr2value': attr2value, 'value2attr': value2attr}
-
-
-def div_pos_neg_data(data, class_name='Class'):
-    pos_data, neg_data = [], []
-    idx = data['heads'].index(class_name)
-    true_attr = data['data'][0][idx]
-
-    # print('true attr:', true_attr)
-
-    for attrs in data['data']:
-        if attrs[idx] == true_attr:
-            del attrs[idx]
-            pos_data.append(attrs)
-        else:
-            del attrs[idx]
-            neg_data.append(attrs)
-    return pos_data, neg_data
-
-
-def get_most_special_hypothesis(num):
-    return [EMPTY] * num
-
-
-def get_most_general_hypothesis(num):
-    return [ANY] * num
-
-
-def is_more_special(G_Set, s_hps):
-    for hps in G_Set:
-        for hps_attr, s_hps_attr in zip(hps, s_hps):
-            if hps_attr == ANY and s_hps_attr != ANY:
-                return True
-    return False
-
-
-def remove_diff_hypothesis_by_pos(G_Set, S_Set, example):
-    new_G_Set = []
-    new_S_Set = []
-    
+EMPTY = -1
+ANY = -2
+WORD_BITS = 64
+
+
+def init_space(vocab_sizes):
+    """the layout of a hypothesis: every attribute owns a run of 64-bit words, one bit per value and a last bit
+    for the values out of its vocabulary, so any value (all bits) never looks like a single value"""
+    vocab_sizes = np.asarray(vocab_sizes, dtype=np.int64)
+    word_nums = (vocab_sizes + WORD_BITS) // WORD_BITS
+    word_starts = np.concatenate([[0], np.cumsum(word_nums)[:-1]]).astype(np.int64)
+    # `full` allows every value of every attribute, `selectors[k]` only the value k of its attribute
+    # and `segments[k]` marks the words of that attribute
+    full = np.zeros(word_nums.sum(), dtype=np.uint64)
+    selectors = np.zeros((vocab_sizes.sum(), word_nums.sum()), dtype=np.uint64)
+    segments = np.zeros_like(selectors)
+    selector = 0
+    for attr_idx, vocab_size in enumerate(vocab_sizes):
+        for code in range(vocab_size + 1):
+            word = word_starts[attr_idx] + code // WORD_BITS
+            full[word] |= np.uint64(1) << np.uint64(code % WORD_BITS)
+            if code < vocab_size:
+                selectors[selector, word] = np.uint64(1) << np.uint64(code % WORD_BITS)
+                segments[selector, word_starts[attr_idx]:word_starts[attr_idx]+word_nums[attr_idx]] = \
+                    np.iinfo(np.uint64).max
+                selector += 1
+    return {'vocab_sizes': vocab_sizes, 'word_nums': word_nums, 'word_starts': word_starts, 'full': full,
+            'selectors': selectors, 'segments': segments,
+            'offsets': np.concatenate([[0], np.cumsum(vocab_sizes)[:-1]]).astype(np.int64)}
+
+
+def init_boundary(space, H):
+    """a boundary of the hypotheses `H` without duplicates, the first of identical rows is kept
+
+    The rows are hashed, so the duplicates are found in linear time. `constrained` marks the attributes every
+    member sets a value for (or no value), its generality index: the fewer, the more general the member.
+    """
+    seen, is_first = set(), np.zeros(len(H), dtype=bool)
+    for row_idx, hps in enumerate(H):
+        key = hps.tobytes()
+        if key not in seen:
+            seen.add(key)
+            is_first[row_idx] = True
+    rows = H[is_first]
+    return {'rows': rows, 'constrained': ~is_any(space, rows)}
+
+
+def select_members(boundary, is_kept):
+    return {'rows': boundary['rows'][is_kept], 'constrained': boundary['constrained'][is_kept]}
+
+
+def get_most_special_hypothesis(space):
+    return init_boundary(space, np.zeros((1, len(space['full'])), dtype=np.uint64))
+
+
+def get_most_general_hypothesis(space):
+    return init_boundary(space, space['full'][None, :].copy())
+
+
+def encode_example(space, example):
+    """an example as a hypothesis allowing only its own values"""
+    return np.bitwise_or.reduce(space['selectors'][space['offsets'] + np.asarray(example)], axis=0)
+
+
+def reduce_attrs(space, word_flags, ufunc):
+    """combine the flags of the words of every attribute, (hypotheses, words) -> (hypotheses, attributes)"""
+    return ufunc.reduceat(word_flags, space['word_starts'], axis=1)
+
+
+def expand_attrs(space, attr_flags):
+    """repeat the flags of every attribute over its words, (hypotheses, attributes) -> (hypotheses, words)"""
+    return np.repeat(attr_flags, space['word_nums'], axis=1)
+
+
+def is_any(space, H):
+    """whether every attribute of every hypothesis of `H` allows any value"""
+    return reduce_attrs(space, H == space['full'], np.logical_and)
+
+
+def is_cover(space, H, example_bits):
+    """whether every hypothesis of `H` allows the values of the example"""
+    return reduce_attrs(space, (H & example_bits) != 0, np.logical_or).all(axis=1)
+
+
+def is_more_special(space, G_Set, S_Set):
+    """for every hypothesis of `S_Set`, whether some member of `G_Set` allows any value where it does not"""
+    G_any, S_any = ~G_Set['constrained'], is_any(space, S_Set)
+    return (G_any[:, None, :] & ~S_any[None, :, :]).any(axis=(0, 2))
+
+
+def remove_diff_hypothesis_by_pos(space, G_Set, S_Set, example_bits):
     # remove unsuit general boundary
-    for hps in G_Set:
-        general = True
-        for emp_attr, hps_attr in zip(example, hps):
-            if emp_attr != hps_attr and hps_attr != ANY:
-                general = False
-                break
-        if general:
-            new_G_Set.append(hps)
-    
-    # remove unsuit special boundary
-    for hps in S_Set:
-        special = True
-        for emp_attr, hps_attr in zip(example, hps):
-            if hps_attr == EMPTY or emp_attr != hps_attr and hps_attr != ANY:
-                special = False
-                new_hps = generalize_hypothesis(hps, example)  # QUESTION: Are there many new hypothesis?
-                # the generalized hypothesis should be more special than hypothesis in G_Set
-                if is_more_special(new_G_Set, new_hps):
-                    new_S_Set.append(new_hps)
-                break
-        if special:
-            new_S_Set.append(hps)
-    
-    # In this process of generalizing special boundary, 
-    # we needn't remove the more general hypothesis in new_S_Set
-    # because we didn't add all the maximum general hypothesis to new_S_Set
-    
-    return new_G_Set, new_S_Set
+    new_G_Set = select_members(G_Set, is_cover(space, G_Set['rows'], example_bits))
 
+    # generalize the special boundary which does not cover the example, the generalized hypothesis
+    # should be more special than hypothesis in G_Set
+    S_rows = S_Set['rows']
+    is_special = is_cover(space, S_rows, example_bits)
+    new_S_rows = np.where(is_special[:, None], S_rows, generalize_hypothesis(space, S_rows, example_bits))
+    is_kept = is_special | is_more_special(space, new_G_Set, new_S_rows)
 
-def check_in_special_set_and_conflict(g_hps, S_Set):
-    attr_num = len(g_hps)
-    for hps in S_Set:
-        # should more general
-        same_attrs = [g_hps_attr for g_hps_attr, hps_attr in zip(g_hps, hps) if g_hps_attr == hps_attr]
-        if len(same_attrs) == attr_num: 
-            return True
-        # the follow noted script is same as the previous
-        # diff_attrs = [g_hps_attr for g_hps_attr, hps_attr in zip(g_hps, hps) if g_hps_attr != hps_attr]
-        # if len(diff_attrs) == 0:
-        #     return True
-
-        # should not be conflict
-        conflict_attrs = [g_hps_attr for g_hps_attr, hps_attr in zip(g_hps, hps) if g_hps_attr != hps_attr and g_hps_attr != ANY]
-        if len(conflict_attrs) > 0:
-            return True
-    return False
-
-
-def remove_more_special_hypothesis(G_Set):
-    new_G_Set = []
-
-    num_G_set = len(G_Set)
-    remove_idxs = []
-    for i in range(num_G_set - 1):
-        prev_hps = G_Set[i]
-        for j in range(i+1, num_G_set):
-            next_hps = G_Set[j]
-            
-            is_same = [0 if prev_hps_attr == next_hps_attr or any([prev_hps_attr, next_hps_attr]) == ANY else 1 
-                       for prev_hps_attr, next_hps_attr in zip(prev_hps, next_hps)]
-            if sum(is_same) == 0:
-                prev_any_num = len([attr for attr in prev_hps if attr == ANY])
-                next_any_num = len([attr for attr in next_hps if attr == ANY])
-                rmv_idx = i if prev_any_num < next_any_num else j
-                remove_idxs.append(rmv_idx)
-    
-    for i in range(num_G_set):
-        if i not in remove_idxs:
-            new_G_Set.append(G_Set[i])
-    return new_G_Set
-
-
-def remove_diff_hypothesis_by_neg(G_Set, S_Set, example, heads, attr2value):
-    new_G_Set = []
-    new_S_Set = []
+    # In this process of generalizing special boundary,
+    # we needn't remove the more general hypothesis in new_S_Set
+    # because we didn't add all the maximum general hypothesis to new_S_Set
 
+    return new_G_Set, init_boundary(space, new_S_rows[is_kept])
+
+
+def check_in_special_set_and_conflict(space, G_Set, S_Set):
+    """for every hypothesis of `G_Set`, whether it equals a member of `S_Set` or sets a value conflicting with one"""
+    is_same = (G_Set[:, None, :] == S_Set[None, :, :]).all(axis=2)
+    is_attr_same = reduce_attrs(space, (G_Set[:, None, :] == S_Set[None, :, :]).reshape(-1, G_Set.shape[1]),
+                                np.logical_and).reshape(len(G_Set), len(S_Set), len(space['word_starts']))
+    is_conflict = (~is_attr_same & ~is_any(space, G_Set)[:, None, :]).any(axis=2)
+    return (is_same | is_conflict).any(axis=1)
+
+
+def remove_more_special_hypothesis(space, G_Set):
+    """remove the members of the general boundary which another member is more general than
+
+    A member h is more general than g exactly when h constrains fewer attributes and g has the values of h on
+    them. The members are grouped by the attributes they constrain, and every group, from the most general,
+    hashes its members on those attributes and is probed with the members constraining more, so the cost is
+    linear in the boundary size for every group instead of quadratic.
+    """
+    rows, constrained = G_Set['rows'], G_Set['constrained']
+    constrained_nums = constrained.sum(axis=1)
+    masks, group_idxs = np.unique(constrained, axis=0, return_inverse=True)
+    group_idxs = group_idxs.ravel()
+    is_kept = np.ones(len(rows), dtype=bool)
+    for group_idx in np.argsort(masks.sum(axis=1), kind='stable'):
+        mask = masks[group_idx]
+        probes = np.flatnonzero(is_kept & (constrained_nums > mask.sum()) & constrained[:, mask].all(axis=1))
+        if len(probes) == 0:
+            continue
+        words = expand_attrs(space, mask[None, :])[0]
+        keys = {hps.tobytes() for hps in rows[group_idxs == group_idx][:, words]}
+        is_kept[probes] = [hps.tobytes() not in keys for hps in rows[probes][:, words]]
+    return select_members(G_Set, is_kept)
+
+
+def remove_diff_hypothesis_by_neg(space, G_Set, S_Set, example_bits, example):
     # remove unsuit special boundary
-    for hps in S_Set:
-        special = False
-        for emp_attr, hps_attr in zip(example, hps):
-            if hps_attr == EMPTY:
-                special = True
-                break
-            elif hps_attr != ANY and hps_attr != emp_attr:  # not equal to negative example means True Rule
-                special = True
-                break
-        if special:
-            new_S_Set.append(hps)
-    
-    # remove unsuit special boundary
-    for hps in G_Set:
-        general = False
-        for emp_attr, hps_attr in zip(example, hps):
-            # not equal to negative example means True Rule
-            if hps_attr != ANY and hps_attr != emp_attr:
-                general = True
-                break
-        if general:
-            new_G_Set.append(hps)
-        else:  # specialize general boundary
-            for idx, (emp_attr, hps_attr) in enumerate(zip(example, hps)):
-                if hps_attr == ANY or hps_attr == emp_attr:
-                    all_values = attr2value[heads[idx]]
-                    for val in all_values:
-                        if val != emp_attr:
-                            new_hps = hps.copy()
-                            new_hps[idx] = val
-                            if not check_in_special_set_and_conflict(new_hps, new_S_Set):
-                                new_G_Set.append(new_hps)
-    
-    # remove the more special hypothesis in new_G_Set
-    new_G_Set = remove_more_special_hypothesis(new_G_Set)
-                    
-    return new_G_Set, new_S_Set
+    new_S_Set = select_members(S_Set, ~is_cover(space, S_Set['rows'], example_bits))
+
+    # a general hypothesis which covers the example is replaced, at its place, by its specializations:
+    # every attribute set to every value but the one of the example
+    G_rows = G_Set['rows']
+    is_general = ~is_cover(space, G_rows, example_bits)
+    selectors = np.flatnonzero(np.isin(np.arange(len(space['selectors'])), space['offsets'] + np.asarray(example),
+                                       invert=True))
+    specialized = np.flatnonzero(~is_general)
+    spec_G_rows = (G_rows[specialized][:, None, :] & ~space['segments'][selectors][None, :, :]) \
+        | space['selectors'][selectors][None, :, :]
+    spec_G_rows = spec_G_rows.reshape(-1, G_rows.shape[1])
+    spec_order = np.repeat(specialized, len(selectors))
+    is_kept = ~check_in_special_set_and_conflict(space, spec_G_rows, new_S_Set['rows'])
+
+    rows = np.concatenate([G_rows[is_general], spec_G_rows[is_kept]])
+    order = np.argsort(np.concatenate([np.flatnonzero(is_general), spec_order[is_kept]]), kind='stable')
+    # the duplicated specializations are dropped when the boundary is built,
+    # then remove the more special hypothesis in new_G_Set
+    new_G_Set = remove_more_special_hypothesis(space, init_boundary(space, rows[order]))
 
+    return new_G_Set, new_S_Set
 
-def generalize_hypothesis(hypothesis, example):
-    new_hps = []
-    for emp_attr, hps_attr in zip(example, hypothesis):
-        if hps_attr == EMPTY:
-            new_hps.append(emp_attr)
-        elif hps_attr == ANY or hps_attr != emp_attr:
-            new_hps.append(ANY)
-        # elif hps_attr == emp_attr:
-        #     new_hps.append(hps_attr)
-        else:  # same as previous note script
-            new_hps.append(hps_attr)
-    return new_hps
 
+def generalize_hypothesis(space, S_Set, example_bits):
+    """the least generalization of every hypothesis to the example: an empty attribute takes the value
+    of the example, an attribute with another value allows any value"""
+    is_empty = reduce_attrs(space, S_Set == 0, np.logical_and)
+    is_same = reduce_attrs(space, (S_Set & example_bits) != 0, np.logical_or)
+    return np.where(expand_attrs(space, is_empty), example_bits,
+                    np.where(expand_attrs(space, is_same), S_Set, space['full']))
 
-def candidate_elimination(data, class_name='Class'):
-    examples = data['data']
-    heads = data['heads']
-    attr2value = data['attr2value']
-    
-    attr_num = len(examples[0])
-    no_class_attr_num = attr_num - 1
 
-    g_hps = get_most_general_hypothesis(no_class_attr_num)
-    s_hps = get_most_special_hypothesis(no_class_attr_num)
-    G_Set = [g_hps]
-    S_Set = [s_hps]
+def decode_hypothesis(space, hps):
+    """a hypothesis as a list of codes, with EMPTY and ANY"""
+    attrs = []
+    for attr_idx, vocab_size in enumerate(space['vocab_sizes']):
+        start = space['word_starts'][attr_idx]
+        words = hps[start:start+space['word_nums'][attr_idx]]
+        codes = np.flatnonzero(np.unpackbits(words.astype('<u8').view(np.uint8), bitorder='little')[:vocab_size+1])
+        attrs.append(EMPTY if len(codes) == 0 else ANY if len(codes) > 1 else int(codes[0]))
+    return attrs
 
-    pos_examples, neg_examples = div_pos_neg_data(data, class_name)
-    tags = [1] * len(pos_examples) + [0] * len(neg_examples)
-    all_examples = pos_examples + neg_examples
 
+def decode_set(space, boundary):
+    return [decode_hypothesis(space, hps) for hps in boundary['rows']]
 
-    print('--- step: {} ---'.format(0))
-    print_set(G_Set, S_Set)
 
-    step = 1
-    for emp, tag in zip(all_examples, tags):
-        if tag:  # positive
-            G_Set, S_Set = remove_diff_hypothesis_by_pos(G_Set, S_Set, emp)
-        else:  # negative
-            G_Set, S_Set = remove_diff_hypothesis_by_neg(G_Set, S_Set, emp, heads, attr2value)
-        print('--- step: {} ---'.format(step))
-        print_set(G_Set, S_Set)
-        step += 1
+def candidate_elimination(data, class_name='Class'):
+    """return the general and special boundaries as lists of hypotheses of codes, with EMPTY and ANY"""
+    heads = get_attr_heads(data, class_name)
+    vocabs = [get_vocab(data, head) for head in heads]
+    space = init_space([len(vocab) for vocab in vocabs])
 
-    return G_Set, S_Set
+    G_Set = get_most_general_hypothesis(space)
+    S_Set = get_most_special_hypothesis(space)
 
+    print('--- step: {} ---'.format(0))
+    print_set(decode_set(space, G_Set), decode_set(space, S_Set), heads, vocabs)
 
-def print_rule(heads, rule):
-    rule_str = '<' + ', '.join([head + '=' + (attr if attr != 'None' else 'Ø') for head, attr in zip(heads, rule)]) + '>'
+    # the examples are consumed chunk by chunk, so `data` can be a stream dataset
+    step = 1
+    for pos_examples, neg_examples in iter_pos_neg_data(data, class_name):
+        tags = [1] * len(pos_examples) + [0] * len(neg_examples)
+        all_examples = pos_examples.tolist() + neg_examples.tolist()
+        for emp, tag in zip(all_examples, tags):
+            example_bits = encode_example(space, emp)
+            if tag:  # positive
+                G_Set, S_Set = remove_diff_hypothesis_by_pos(space, G_Set, S_Set, example_bits)
+            else:  # negative
+                G_Set, S_Set = remove_diff_hypothesis_by_neg(space, G_Set, S_Set, example_bits, emp)
+            print('--- step: {} ---'.format(step))
+            print_set(decode_set(space, G_Set), decode_set(space, S_Set), heads, vocabs)
+            step += 1
+
+    return decode_set(space, G_Set), decode_set(space, S_Set)
+
+
+def decode_attr(vocab, attr):
+    if attr == ANY:
+        return '?'
+    elif attr == EMPTY:
+        return 'Ø'
+    return vocab[attr]
+
+
+def print_rule(heads, vocabs, rule):
+    rule_str = '<' + ', '.join([head + '=' + decode_attr(vocab, attr) for head, vocab, attr in zip(heads, vocabs, rule)]) + '>'
     return rule_str
 
 
-def print_set(G_Set, S_Set):
+def print_set(G_Set, S_Set, heads, vocabs):
     print('\t--- special boundary ---')
     for idx, hps in enumerate(S_Set):
-        print('\tspecial {}: '.format(idx), print_rule(data['heads'], hps))
+        print('\tspecial {}: '.format(idx), print_rule(heads, vocabs, hps))
     print('\t--- general boundary ---')
     for idx, hps in enumerate(G_Set):
-        print('\tgeneral {}: '.format(idx), print_rule(data['heads'], hps))
+        print('\tgeneral {}: '.format(idx), print_rule(heads, vocabs, hps))
 
 if __name__ == '__main__':
     DATA_DIR = './data'
@@ -262,6 +269,8 @@ if __name__ == '__main__':
     filename = os.path.join(DATA_DIR, DATA_FILE)
     data = read_data(filename)
     G_Set, S_Set = candidate_elimination(data, class_name='EnjoySport')
+    heads = get_attr_heads(data, class_name='EnjoySport')
+    vocabs = [get_vocab(data, head) for head in heads]
     print('--- final ---')
-    print_set(G_Set, S_Set)
+    print_set(G_Set, S_Set, heads, vocabs)
 
@@ -10,50 +10,12 @@ Note: simply ignore every negative example
 """
 
 import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_vocab, get_attr_heads, iter_pos_neg_data
 
-EMPTY = 'None'
-ANY = '?'
-
-
-def read_data(filename):
-    data = []
-    attr2value = {}
-    value2attr = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-                if attr not in value2attr:
-                    value2attr[attr] = head
-    return {'heads': heads, 'data': data, 'attr2value': attr2value, 'value2attr': value2attr}
-
-
-def div_pos_neg_data(data, class_name='Class'):
-    pos_data, neg_data = [], []
-    idx = data['heads'].index(class_name)
-    true_attr = data['data'][0][idx]
-
-    # print('true attr:', true_attr)
-
-    for attrs in data['data']:
-        if attrs[idx] == true_attr:
-            del attrs[idx]
-            pos_data.append(attrs)
-        else:
-            del attrs[idx]
-            neg_data.append(attrs)
-    return pos_data, neg_data
+EMPTY = -1
+ANY = -2
 
 
 def get_most_special_hypothesis(num):
@@ -74,27 +36,32 @@ def generalize_hypothesis(hypothesis, example):
     return new_hps
 
 
-def Find_S(data, class_name='Class'):
-    examples = data['data']
-    heads = data['heads']
-    
-    attr_num = len(examples[0])
-    no_class_attr_num = attr_num - 1
+def decode_attr(vocab, hps_attr):
+    if hps_attr == ANY:
+        return '?'
+    elif hps_attr == EMPTY:
+        return 'None'
+    return vocab[hps_attr]
 
-    hps = get_most_special_hypothesis(no_class_attr_num)
 
-    pos_examples, _ = div_pos_neg_data(data, class_name)
+def Find_S(data, class_name='Class'):
+    heads = get_attr_heads(data, class_name)
+    vocabs = [get_vocab(data, head) for head in heads]
+
+    hps = get_most_special_hypothesis(len(heads))
 
+    # the examples are consumed chunk by chunk, so `data` can be a stream dataset
     u_idx = 0
-    for emp in pos_examples:
-        for emp_attr, hps_attr in zip(emp, hps):
-            if hps_attr==EMPTY or emp_attr != hps_attr and hps_attr != ANY:
-                u_idx += 1
-                hps = generalize_hypothesis(hps, emp)
-                print(' -- update {} times-- '.format(u_idx))
-                break
+    for pos_examples, _ in iter_pos_neg_data(data, class_name):
+        for emp in pos_examples.tolist():
+            for emp_attr, hps_attr in zip(emp, hps):
+                if hps_attr==EMPTY or emp_attr != hps_attr and hps_attr != ANY:
+                    u_idx += 1
+                    hps = generalize_hypothesis(hps, emp)
+                    print(' -- update {} times-- '.format(u_idx))
+                    break
     
-    res_hps = {head: '?' if hps_attr==ANY else hps_attr for head, hps_attr in zip(heads, hps)}
+    res_hps = {head: decode_attr(vocab, hps_attr) for head, vocab, hps_attr in zip(heads, vocabs, hps)}
 
     return res_hps
 
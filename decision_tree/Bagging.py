@@ -0,0 +1,116 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+algorithm introduction
+
+Description: Bagging, an ensemble of ID3 trees voting by majority
+             1. every tree learns from a bootstrap sample, drawn as an integer weight per row of the
+                encoded matrix instead of a copy of the data, rows drawn zero times are skipped
+             2. with `attr_num` every tree only sees a random subset of the attributes (random subspace)
+             3. the trees are built in a process pool, the encoded matrix is put into shared memory once
+                and every worker attaches it when it starts, a task is only the seed of its tree
+             4. the trees are compiled, so the ensemble votes on a whole encoded batch at once
+"""
+
+import os
+import sys
+import multiprocessing
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_weights, get_attr_heads
+from utils.shared_array import share_array, attach_array, release_array
+from decision_tree.ID3 import build_tree, decode_tree, compile_tree, route_tree
+
+# the state of a worker process, set once by `init_worker`
+WORKER = {}
+
+
+def init_worker(specs, schema, class_name, attr_num):
+    """attach the shared code matrix and weights, keep them for every tree this process builds"""
+    blocks, arrays = zip(*[attach_array(spec) for spec in specs])
+    WORKER['blocks'] = blocks
+    set_worker(arrays[0], arrays[1], schema, class_name, attr_num)
+
+
+def set_worker(codes, weights, schema, class_name, attr_num):
+    """the state shared by every tree: a dataset over `codes` and the columns of the class and attributes"""
+    heads = schema['heads']
+    class_idx = heads.index(class_name)
+    WORKER.update({
+        'data': dict(schema, codes=codes, weights=weights),
+        'labels': codes[:, class_idx].astype(np.intp),
+        'attr_idxs': [idx for idx in range(len(heads)) if idx != class_idx],
+        'vocab_sizes': np.array([len(vocab) for vocab in schema['vocabs']]),
+        'class_num': len(schema['vocabs'][class_idx]),
+        'class_name': class_name,
+        'attr_num': attr_num,
+    })
+
+
+def build_bagged_tree(seed):
+    """worker: grow and compile one tree on the bootstrap sample and attribute subset drawn from `seed`"""
+    data, class_name = WORKER['data'], WORKER['class_name']
+    weights = data['weights']
+    rng = np.random.RandomState(seed)
+    # a bootstrap sample of the weighted rows, as the number of times every row is drawn
+    boot_weights = rng.multinomial(int(round(weights.sum())), weights / weights.sum()).astype(np.float64)
+    attr_idxs = WORKER['attr_idxs']
+    if WORKER['attr_num'] is not None:
+        attr_idxs = sorted(rng.choice(attr_idxs, min(WORKER['attr_num'], len(attr_idxs)), replace=False).tolist())
+    tree = build_tree(data['codes'], WORKER['labels'], boot_weights, attr_idxs, WORKER['vocab_sizes'],
+                      WORKER['class_num'], order=np.flatnonzero(boot_weights))
+    decision_tree = {'Root': decode_tree(tree, data['heads'], data['vocabs'], class_name)}
+    # the fallback labels and class counts of the nodes come from the bootstrap sample only
+    return compile_tree(decision_tree, data, class_name, weights=boot_weights)
+
+
+def bagging(data, class_name='Class', tree_num=100, attr_num=None, n_jobs=1, seed=0):
+    """learn `tree_num` compiled ID3 trees on bootstrap samples of `data`, `n_jobs` None uses every cpu"""
+    codes = np.asarray(data['codes'])
+    weights = get_weights(data)
+    schema = {'heads': data['heads'], 'vocabs': data['vocabs'], 'value2code': data['value2code']}
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=tree_num)
+    if n_jobs == 1:
+        set_worker(codes, weights, schema, class_name, attr_num)
+        trees = [build_bagged_tree(tree_seed) for tree_seed in seeds]
+        WORKER.clear()
+    else:
+        blocks, arrays, specs = zip(*[share_array(array) for array in (codes, weights)])
+        del arrays
+        try:
+            with multiprocessing.Pool(n_jobs, initializer=init_worker,
+                                      initargs=(specs, schema, class_name, attr_num)) as pool:
+                chunk_size = max(1, tree_num // (4 * (n_jobs or os.cpu_count())))
+                trees = pool.map(build_bagged_tree, seeds, chunksize=chunk_size)
+        finally:
+            for shm in blocks:
+                release_array(shm)
+    return {'attr_heads': get_attr_heads(data, class_name),
+            'class_vocab': data['vocabs'][data['heads'].index(class_name)],
+            'trees': trees}
+
+
+def cal_votes(ensemble, X):
+    """the number of trees voting for every class of every encoded row of `X`, one row per example"""
+    X = np.asarray(X)
+    class_num = len(ensemble['class_vocab'])
+    labels = np.stack([tree['label'][route_tree(tree, X)] for tree in ensemble['trees']], axis=1)
+    keys = np.arange(len(X))[:, None] * class_num + labels
+    return np.bincount(keys.ravel(), minlength=len(X) * class_num).reshape(len(X), class_num)
+
+
+def predict(ensemble, X):
+    """class codes of the encoded rows `X` (columns in the order of `ensemble['attr_heads']`), ties go to the first class"""
+    return np.argmax(cal_votes(ensemble, X), axis=1)
+
+
+if __name__ == '__main__':
+    DATA_DIR = './data'
+    DATA_FILE = 'play_tennis'
+    filename = os.path.join(DATA_DIR, DATA_FILE)
+    data = read_data(filename, no_use_heads=['Day'])
+    ensemble = bagging(data, class_name='PlayTennis', tree_num=25, attr_num=3, n_jobs=2)
+    X = data['codes'][:, [data['heads'].index(head) for head in ensemble['attr_heads']]]
+    labels = data['codes'][:, data['heads'].index('PlayTennis')]
+    print('train accuracy: ', np.mean(predict(ensemble, X) == labels))
@@ -5,133 +5,632 @@
 algorithm introduction
 
 Description: ID3, a Top-Down Greedy Search Algorithm
+             1. the information gain of every attribute at a node comes from one weighted
+                (attribute value, class) count table, so any number of classes is supported
+             2. the tree is grown with an explicit stack over slices of one row index array,
+                the data matrix itself is never copied
+             3. `level_wise=True` grows the tree breadth first instead, with one pass over the data per level
+             4. `n_jobs` > 1 builds the large subtrees in a process pool over shared memory
+             5. `compile_tree` flattens a learned tree into arrays, `predict` scores a whole encoded batch
+             6. `numeric_heads` are binned once by weighted quantiles and split in two at the best bin threshold,
+                found from cumulative class counts over the bins, a compiled tree compares the numbers of the
+                rows with the thresholds, so numbers unseen in training are routed too
+             7. `prune_tree` does reduced-error pruning of a compiled tree against a validation set
 
 """
 
 import os
+import sys
 import random
+import multiprocessing
 import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_weights, get_attr_heads, iter_codes, parse_number
+from utils.shared_array import share_array, attach_array, release_array
 
 
-PURE_NEG = 'neg'
-PURE_POS = 'pos'
-
-
-def read_data(filename, no_use_heads=[]):
-    data = []
-    attr2value = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        no_use_idxs = [heads.index(no_use_head) for no_use_head in no_use_heads]
-        heads = [head for head in heads if head not in no_use_heads]
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            attrs = [attr for a_idx, attr in enumerate(attrs) if a_idx not in no_use_idxs]
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-    return {'heads': heads, 'data': data, 'attr2value': attr2value}
-
-
-def cal_entropy(data, class_idx, pos_class_val, check_pure=False):
-    all_data_num = len(data)
-    pos_data_num = len([item for item in data if item[class_idx] == pos_class_val])
-    neg_data_num = all_data_num - pos_data_num
-    
-    is_pure = None
-    if pos_data_num == 0:
-        is_pure = PURE_NEG
-    elif pos_data_num == all_data_num:
-        is_pure = PURE_POS
-    else:
-        is_pure = 1 if pos_data_num >= neg_data_num else 0
-
-    ce_org = 0
-    if pos_data_num:
-        ce_org += - pos_data_num / all_data_num * np.log(pos_data_num / all_data_num)
-    if neg_data_num:
-        ce_org += - neg_data_num / all_data_num * np.log(neg_data_num / all_data_num)
-    
-    if check_pure:
-        return ce_org, is_pure
-    else:
-        return ce_org
+GAIN_EPS = 1e-12  # a smaller gain is regarded as no gain at all
 
 
-def cal_max_gain(data, used_attrs, attr2value, heads, class_name='Class'):
-    data_num = len(data)
-    class_idx = heads.index(class_name)
-    pos_class_val, neg_class_val = attr2value[class_name]  # maybe not match exactly, but don't care
+def cal_entropy(class_counts):
+    """entropy of the class count vectors along the last axis of `class_counts`"""
+    all_num = class_counts.sum(axis=-1, keepdims=True)
+    probs = np.divide(class_counts, all_num, out=np.zeros(class_counts.shape), where=all_num > 0)
+    logs = np.log(probs, out=np.zeros(probs.shape), where=probs > 0)
+    return - (probs * logs).sum(axis=-1)
 
-    org_ce, is_pure =  cal_entropy(data, class_idx, pos_class_val, check_pure=True)
 
-    if is_pure == PURE_POS:
-        return {'label': pos_class_val}
-    elif is_pure == PURE_POS:
-        return {'label': neg_class_val}
-    else:
-        all_attrs = set(heads) - set(used_attrs)
-        # all_attrs = [head for head in heads if head not in used_attrs]
-        if len(all_attrs) == 0:
-            return {'label': pos_class_val} if is_pure == 1 else {'label': neg_class_val}
-        else:
-            max_gain = 0
-            best_attr = None
-            best_data_lst = None
-
-            for attr in all_attrs:
-                attr_vals = attr2value[attr]
-                attr_idx = heads.index(attr)
-
-                split_data_lst = {val: [] for val in attr_vals}
-                for item in data:
-                    split_data_lst[item[attr_idx]].append(item)
-                
-                attr_ce = 0
-                for val in attr_vals:
-                    if len(split_data_lst[val]) != 0:
-                        attr_ce += len(split_data_lst[val]) / data_num * cal_entropy(split_data_lst[val], class_idx, pos_class_val)
-
-                attr_gain = org_ce - attr_ce
-                if attr_gain > max_gain:
-                    max_gain = attr_gain
-                    best_attr = attr
-                    best_data_lst = split_data_lst
-            
-            if best_attr == None:
-                return {'label': pos_class_val} if is_pure == 1 else {'label': neg_class_val}
+def cal_class_counts(labels, weights, class_num):
+    """weighted number of examples of every class"""
+    return np.bincount(labels, weights=weights, minlength=class_num)
+
+
+def cal_contingency(codes, labels, weights, attr_idxs, vocab_sizes, class_num):
+    """weighted (attribute value, class) counts of all attributes `attr_idxs` in one pass
+
+    The values of all attributes are laid end to end, row `offsets[i] + val` of the result
+    holds the class counts of value `val` of attribute `attr_idxs[i]`.
+    """
+    val_sizes = vocab_sizes[attr_idxs]
+    offsets = np.concatenate([[0], np.cumsum(val_sizes)[:-1]])
+    keys = (codes.astype(np.int64) + offsets) * class_num + labels[:, None]
+    counts = np.bincount(keys.ravel(), weights=np.repeat(weights, len(attr_idxs)),
+                         minlength=val_sizes.sum() * class_num)
+    return counts.reshape(-1, class_num), val_sizes
+
+
+def select_best(gains, axis=-1):
+    """index of the best gain along `axis`, the first one within GAIN_EPS of the maximum
+
+    Equal gains differ in the last bits with the order of their float sums, so a tie goes to the
+    first attribute (or threshold) whatever way the gains were computed.
+    """
+    gains = np.asarray(gains)
+    return np.argmax(gains >= gains.max(axis=axis, keepdims=True) - GAIN_EPS, axis=axis)
+
+
+def cal_threshold_gain(table, class_counts):
+    """best binary threshold of one numeric attribute from its (bin, class) count table
+
+    The bins are sorted by value, so the counts left of every threshold are a cumulative sum;
+    threshold `t` sends the bins <= t left. Return the best gain and its threshold (-1 for none).
+    """
+    if len(table) < 2:
+        return 0.0, -1
+    left = np.cumsum(table, axis=0)[:-1]
+    right = class_counts - left
+    split_ce = (left.sum(axis=1) * cal_entropy(left) + right.sum(axis=1) * cal_entropy(right)) / class_counts.sum()
+    gains = cal_entropy(class_counts) - split_ce
+    best = int(select_best(gains))
+    return gains[best], best
+
+
+def cal_gains(codes, labels, weights, attr_idxs, vocab_sizes, class_num, numeric_mask=None):
+    """information gain of every attribute in `attr_idxs`, `codes` only holds these columns
+
+    A numeric attribute is split in two at its best bin threshold, which is returned too
+    (-1 for a categorical attribute).
+    """
+    class_counts = cal_class_counts(labels, weights, class_num)
+    table, val_sizes = cal_contingency(codes, labels, weights, attr_idxs, vocab_sizes, class_num)
+    val_nums = table.sum(axis=1)
+    val_attrs = np.repeat(np.arange(len(attr_idxs)), val_sizes)
+    attr_ce = np.bincount(val_attrs, weights=val_nums * cal_entropy(table), minlength=len(attr_idxs)) / class_counts.sum()
+    gains = cal_entropy(class_counts) - attr_ce
+    thresholds = - np.ones(len(attr_idxs), dtype=np.int64)
+    if numeric_mask is not None:
+        offsets = np.concatenate([[0], np.cumsum(val_sizes)[:-1]])
+        for i, attr_idx in enumerate(attr_idxs):
+            if numeric_mask[attr_idx]:
+                attr_table = table[offsets[i]:offsets[i] + val_sizes[i]]
+                gains[i], thresholds[i] = cal_threshold_gain(attr_table, class_counts)
+    return gains, thresholds
+
+
+def cal_max_gain(codes, labels, weights, node_idxs, attr_idxs, vocab_sizes, class_num, numeric_mask=None):
+    """choose the split of the node holding rows `node_idxs`, return its majority label, best attribute and threshold
+
+    The best attribute is None when the node should be a leaf, the threshold is -1 for a categorical split.
+    """
+    node_labels, node_weights = labels[node_idxs], weights[node_idxs]
+    class_counts = cal_class_counts(node_labels, node_weights, class_num)
+    # the majority class, ties go to the class seen first in the data
+    label = int(np.argmax(class_counts))
+
+    if np.count_nonzero(class_counts) <= 1 or len(attr_idxs) == 0:
+        return label, None, -1
+
+    node_codes = codes[np.ix_(node_idxs, attr_idxs)]
+    gains, thresholds = cal_gains(node_codes, node_labels, node_weights, attr_idxs, vocab_sizes, class_num, numeric_mask)
+    best = int(select_best(gains))
+    if gains[best] <= GAIN_EPS:
+        return label, None, -1
+    return label, attr_idxs[best], int(thresholds[best])
+
+
+def partition_rows(codes, order, start, end, attr_idx, val_size, threshold=-1):
+    """stable sort `order[start:end]` by the value of `attr_idx` in place, return the bounds of every value
+
+    With a `threshold` the rows are split in two instead: bins <= threshold first.
+    """
+    node_idxs = order[start:end]
+    vals = codes[node_idxs, attr_idx]
+    if threshold >= 0:
+        vals, val_size = (vals > threshold).astype(np.int64), 2
+    order[start:end] = node_idxs[np.argsort(vals, kind='stable')]
+    val_nums = np.bincount(vals, minlength=val_size)
+    return start + np.concatenate([[0], np.cumsum(val_nums)])
+
+
+def build_tree(codes, labels, weights, attr_idxs, vocab_sizes, class_num, order=None, start=0, end=None, spawn=None,
+               numeric_mask=None):
+    """grow the tree of the rows `order[start:end]` on the shared matrix `codes` with an explicit work stack
+
+    Every node owns a slice of the row index array `order`, which is partitioned in place
+    by the split attribute, so no rows are copied and the depth is not bounded by recursion.
+    `spawn(node, start, end, attr_idxs)` may take over the subtree of any node below the root
+    by returning True. The columns flagged in `numeric_mask` hold sorted bin codes and get
+    binary splits {('<=', bin): ..., ('>', bin): ...}; they stay usable further down.
+    """
+    if order is None:
+        order = np.arange(len(codes))
+    end = len(order) if end is None else end
+    root = {}
+    stack = [(root, start, end, attr_idxs)]
+    while stack:
+        node, start, end, node_attr_idxs = stack.pop()
+        if spawn is not None and node is not root and spawn(node, start, end, node_attr_idxs):
+            continue
+        label, best_attr, threshold = cal_max_gain(codes, labels, weights, order[start:end], node_attr_idxs,
+                                                   vocab_sizes, class_num, numeric_mask)
+        if best_attr is None:
+            node['label'] = label
+            continue
+        if threshold >= 0:
+            bounds = partition_rows(codes, order, start, end, best_attr, 2, threshold)
+            node[best_attr] = {('<=', threshold): {}, ('>', threshold): {}}
+            for val, key in enumerate(node[best_attr]):
+                stack.append((node[best_attr][key], bounds[val], bounds[val+1], node_attr_idxs))
+            continue
+        rest_attr_idxs = [idx for idx in node_attr_idxs if idx != best_attr]
+        bounds = partition_rows(codes, order, start, end, best_attr, vocab_sizes[best_attr])
+        node[best_attr] = {}
+        for val in range(vocab_sizes[best_attr]):
+            node[best_attr][val] = {}
+            if bounds[val] == bounds[val+1]:
+                node[best_attr][val]['label'] = label
+            else:
+                stack.append((node[best_attr][val], bounds[val], bounds[val+1], rest_attr_idxs))
+    return root
+
+
+def build_subtree(args):
+    """worker: grow the subtree of `order[start:end]`, all arrays are attached from shared memory"""
+    specs, start, end, attr_idxs, vocab_sizes, class_num, numeric_mask = args
+    blocks, arrays = zip(*[attach_array(spec) for spec in specs])
+    codes, labels, weights, order = arrays
+    try:
+        return build_tree(codes, labels, weights, attr_idxs, vocab_sizes, class_num, order=order, start=start, end=end,
+                          numeric_mask=numeric_mask)
+    finally:
+        del codes, labels, weights, order, arrays
+        for shm in blocks:
+            shm.close()
+
+
+def build_tree_parallel(codes, labels, weights, attr_idxs, vocab_sizes, class_num, n_jobs=None,
+                        min_parallel_rows=10000, numeric_mask=None):
+    """grow the tree like `build_tree`, but farm every subtree of at least `min_parallel_rows` rows out to a pool
+
+    The code matrix, labels, weights and row index array are put into shared memory once, a worker only
+    gets the slice bounds of its subtree and partitions its own part of the shared index array.
+    """
+    blocks, arrays, specs = zip(*[share_array(array) for array in (codes, labels, weights, np.arange(len(codes)))])
+    shared_codes, shared_labels, shared_weights, shared_order = arrays
+    try:
+        with multiprocessing.Pool(n_jobs) as pool:
+            tasks = []
+
+            def spawn(node, start, end, node_attr_idxs):
+                if end - start < min_parallel_rows:
+                    return False
+                args = (specs, start, end, node_attr_idxs, vocab_sizes, class_num, numeric_mask)
+                tasks.append((node, pool.apply_async(build_subtree, (args,))))
+                return True
+
+            root = build_tree(shared_codes, shared_labels, shared_weights, attr_idxs, vocab_sizes, class_num,
+                              order=shared_order, spawn=spawn, numeric_mask=numeric_mask)
+            for node, task in tasks:
+                node.update(task.get())
+    finally:
+        del shared_codes, shared_labels, shared_weights, shared_order, arrays
+        for shm in blocks:
+            release_array(shm)
+    return root
+
+
+def route_rows(codes, node_of_row, start, end, child_pos, split_cols):
+    """move the rows [start, end) from their frontier node to the child node picked by the split code"""
+    rows = node_of_row[start:end]
+    is_open = rows >= 0
+    open_rows = rows[is_open]
+    row_idxs = np.arange(start, end)[is_open]
+    vals = np.asarray(codes[row_idxs, split_cols[open_rows]], dtype=np.int64)
+    rows[is_open] = child_pos[open_rows, vals]
+
+
+def count_level(codes, labels, weights, node_of_row, node_start, node_end, attr_idxs, offsets, val_num, class_num,
+                chunk_rows, route=None):
+    """(node, attribute value, class) and (node, class) counts of the frontier nodes [node_start, node_end)
+
+    One sequential pass of `chunk_rows` rows at a time, `route` moves the rows of the last level
+    to their children on the way.
+    """
+    attr_num = len(attr_idxs)
+    node_num = node_end - node_start
+    table = np.zeros(node_num * val_num * class_num)
+    class_counts = np.zeros(node_num * class_num)
+    for start in range(0, len(codes), chunk_rows):
+        end = min(start + chunk_rows, len(codes))
+        if route is not None:
+            route_rows(codes, node_of_row, start, end, *route)
+        rows = node_of_row[start:end]
+        is_open = (rows >= node_start) & (rows < node_end)
+        if not is_open.any():
+            continue
+        open_rows = rows[is_open] - node_start
+        row_idxs = np.arange(start, end)[is_open]
+        chunk_labels, chunk_weights = labels[row_idxs], weights[row_idxs]
+        class_counts += np.bincount(open_rows * class_num + chunk_labels, weights=chunk_weights,
+                                    minlength=class_counts.size)
+        if attr_num:
+            chunk_codes = np.asarray(codes[np.ix_(row_idxs, attr_idxs)], dtype=np.int64)
+            keys = (open_rows[:, None] * val_num + offsets + chunk_codes) * class_num + chunk_labels[:, None]
+            table += np.bincount(keys.ravel(), weights=np.repeat(chunk_weights, attr_num), minlength=table.size)
+    return table.reshape(node_num, val_num, class_num), class_counts.reshape(node_num, class_num)
+
+
+def build_tree_levelwise(codes, labels, weights, attr_idxs, vocab_sizes, class_num, chunk_rows=1 << 16,
+                         max_cells=1 << 24):
+    """grow the tree breadth first, all open nodes of a level are counted together
+
+    `node_of_row[i]` is the frontier position of the node holding row `i` (-1 once that node is finished).
+    A level is one sequential scan over `codes` (so it may be memory-mapped); only when the count table
+    of the level exceeds `max_cells` cells are its nodes counted in several batches.
+    """
+    attr_num = len(attr_idxs)
+    val_sizes = vocab_sizes[attr_idxs]
+    offsets = np.concatenate([[0], np.cumsum(val_sizes)[:-1]]).astype(np.int64)
+    val_num = int(val_sizes.sum())
+    max_val_size = int(val_sizes.max()) if attr_num else 1
+    batch_size = max(1, max_cells // max(1, val_num * class_num))
+
+    root = {}
+    frontier = [root]
+    attr_masks = np.ones((1, attr_num), dtype=bool)
+    node_of_row = np.zeros(len(codes), dtype=np.int64)
+    route = None
+    while frontier:
+        node_num = len(frontier)
+        next_frontier, next_masks = [], []
+        child_pos = - np.ones((node_num, max_val_size), dtype=np.int64)
+        split_cols = np.zeros(node_num, dtype=np.int64)
+        for node_start in range(0, node_num, batch_size):
+            node_end = min(node_start + batch_size, node_num)
+            table, class_counts = count_level(codes, labels, weights, node_of_row, node_start, node_end, attr_idxs,
+                                              offsets, val_num, class_num, chunk_rows, route)
+            route = None
+
+            # choose the splits of the whole batch at once
+            node_labels = np.argmax(class_counts, axis=1)
+            val_nums = table.sum(axis=2)
+            if attr_num:
+                # most cells of a deep level are empty, only the seen values need an entropy
+                val_ce = np.zeros(val_nums.shape)
+                is_seen = val_nums > 0
+                val_ce[is_seen] = val_nums[is_seen] * cal_entropy(table[is_seen])
+                attr_ce = np.add.reduceat(val_ce, offsets, axis=1) / class_counts.sum(axis=1, keepdims=True)
+                gains = cal_entropy(class_counts)[:, None] - attr_ce
+                gains[~attr_masks[node_start:node_end]] = - np.inf
+                bests = select_best(gains, axis=1)
+                is_split = (np.count_nonzero(class_counts, axis=1) > 1) & attr_masks[node_start:node_end].any(axis=1) \
+                           & (gains[np.arange(node_end - node_start), bests] > GAIN_EPS)
             else:
-                decision_tree = {best_attr: {val: {} for val in attr2value[best_attr]}}
-                used_attrs.append(best_attr)
-                for val in attr2value[best_attr]:
-                    if len(best_data_lst[val]) == 0:
-                        decision_tree[best_attr][val] = {'label': pos_class_val} if is_pure == 1 else {'label': neg_class_val}
+                bests = np.zeros(node_end - node_start, dtype=np.int64)
+                is_split = np.zeros(node_end - node_start, dtype=bool)
+
+            for pos in range(node_start, node_end):
+                node, label = frontier[pos], int(node_labels[pos - node_start])
+                if not is_split[pos - node_start]:
+                    node['label'] = label
+                    continue
+                best = bests[pos - node_start]
+                best_attr = attr_idxs[best]
+                split_cols[pos] = best_attr
+                child_mask = attr_masks[pos].copy()
+                child_mask[best] = False
+                node[best_attr] = {}
+                for val in range(vocab_sizes[best_attr]):
+                    node[best_attr][val] = {}
+                    if val_nums[pos - node_start, offsets[best] + val] == 0:
+                        node[best_attr][val]['label'] = label
                     else:
-                        decision_tree[best_attr][val] = cal_max_gain(best_data_lst[val], used_attrs.copy(), attr2value, heads, class_name)
-    
-    return decision_tree
+                        child_pos[pos, val] = len(next_frontier)
+                        next_frontier.append(node[best_attr][val])
+                        next_masks.append(child_mask)
+        frontier = next_frontier
+        attr_masks = np.array(next_masks, dtype=bool).reshape(-1, attr_num)
+        route = (child_pos, split_cols)
+    return root
+
+
+def decode_tree(tree, heads, vocabs, class_name='Class', bin_edges={}):
+    class_vocab = vocabs[heads.index(class_name)]
+    root = {}
+    stack = [(tree, root)]
+    while stack:
+        node, decoded = stack.pop()
+        if 'label' in node:
+            decoded['label'] = class_vocab[node['label']]
+            continue
+        attr, branches = next(iter(node.items()))
+        decoded[heads[attr]] = {}
+        for val, sub_tree in branches.items():
+            if attr in bin_edges:
+                # a numeric split ('<=', bin) / ('>', bin) reads `<= value` / `> value`
+                key = val[0] + ' ' + repr(float(bin_edges[attr][val[1]]))
+            else:
+                key = vocabs[attr][val]
+            decoded[heads[attr]][key] = {}
+            stack.append((sub_tree, decoded[heads[attr]][key]))
+    return root
+
+
+def get_numeric_values(vocab):
+    """the number written by every value of a vocabulary, nan when it is not a number"""
+    return np.array([parse_number(value) for value in vocab], dtype=np.float64)
+
 
+def make_bins(column, weights, values, bin_num=32):
+    """quantile bin edges of a numeric column, from one sort of its distinct values
 
-def ID3(data, class_name='Class'):
-    examples = data['data']
+    `values[code]` is the number of code `code`; the edges are values of the data,
+    a row belongs to the first bin whose edge is not less than its value.
+    """
+    code_weights = np.bincount(column, weights=weights, minlength=len(values))
+    order = np.argsort(values, kind='stable')
+    order = order[code_weights[order] > 0]
+    sorted_values, cum_weights = values[order], np.cumsum(code_weights[order])
+    targets = cum_weights[-1] * np.arange(1, bin_num + 1) / bin_num
+    edge_idxs = np.minimum(np.searchsorted(cum_weights, targets), len(order) - 1)
+    return np.unique(sorted_values[edge_idxs])
+
+
+def ID3(data, class_name='Class', level_wise=False, n_jobs=1, min_parallel_rows=10000, numeric_heads=[], bin_num=32):
     heads = data['heads']
-    attr2value = data['attr2value']
+    vocabs = data['vocabs']
+    codes = np.asarray(data['codes'])
+    class_idx = heads.index(class_name)
+    labels = codes[:, class_idx].astype(np.intp)
+    attr_idxs = [idx for idx in range(len(heads)) if idx != class_idx]
+    vocab_sizes = np.array([len(vocab) for vocab in vocabs])
+    weights, class_num = get_weights(data), len(vocabs[class_idx])
+
+    # numeric columns are binned once, the bins replace their codes and keep the order of the values
+    bin_edges, numeric_mask = {}, None
+    if numeric_heads:
+        if level_wise:
+            raise ValueError('numeric attributes are not supported by the level-wise builder')
+        codes = codes.copy()
+        numeric_mask = np.zeros(len(heads), dtype=bool)
+        for head in numeric_heads:
+            idx = heads.index(head)
+            values = get_numeric_values(vocabs[idx])
+            if np.isnan(values).any():
+                raise ValueError('column {} is not numeric'.format(head))
+            bin_edges[idx] = make_bins(codes[:, idx], weights, values, bin_num)
+            codes[:, idx] = np.searchsorted(bin_edges[idx], values[codes[:, idx]])
+            vocab_sizes[idx] = len(bin_edges[idx])
+            numeric_mask[idx] = True
 
-    used_attrs = [class_name]
     decision_tree = {'Root': None}
-    decision_tree['Root'] = cal_max_gain(examples, used_attrs, attr2value, heads, class_name)
+    if level_wise:
+        decision_tree['Root'] = build_tree_levelwise(codes, labels, weights, attr_idxs, vocab_sizes, class_num)
+    elif n_jobs != 1:
+        decision_tree['Root'] = build_tree_parallel(codes, labels, weights, attr_idxs, vocab_sizes, class_num,
+                                                    n_jobs=n_jobs, min_parallel_rows=min_parallel_rows,
+                                                    numeric_mask=numeric_mask)
+    else:
+        decision_tree['Root'] = build_tree(codes, labels, weights, attr_idxs, vocab_sizes, class_num,
+                                           numeric_mask=numeric_mask)
+    decision_tree['Root'] = decode_tree(decision_tree['Root'], heads, vocabs, class_name, bin_edges)
 
     return decision_tree
 
 
+def compile_tree(decision_tree, data, class_name='Class', weights=None):
+    """compile the nested dict tree of `ID3` into flat arrays, numbered breadth first
+
+    `feature[node]` is the attribute column tested at `node` (-1 for a leaf), `children[node, code]`
+    the child for value `code` (-1 for none) and `label[node]` the class predicted when a row
+    stops at `node`: the leaf label, or the majority class of the training rows which reached
+    an inner node, used when a row has a value the tree has not seen there.
+    A numeric split has `threshold[node]` (nan otherwise) and children 0 (<=) and 1 (>), the columns of
+    `numeric_heads` are compared as numbers, so rows hold the numbers of these columns rather than codes.
+    With `weights` (one per row of the in-memory `data`, e.g. a bootstrap sample) the training rows are
+    counted with these weights, and the rows of weight 0 are not routed at all.
+    """
+    attr_heads = get_attr_heads(data, class_name)
+    heads = data['heads']
+    class_idx = heads.index(class_name)
+    class_value2code = data['value2code'][class_idx]
+
+    nodes, parents, feature, label, threshold, branches = [decision_tree['Root']], [-1], [], [], [], []
+    idx = 0
+    while idx < len(nodes):
+        node = nodes[idx]
+        branches.append({})
+        if 'label' in node:
+            feature.append(-1)
+            label.append(class_value2code[node['label']])
+            threshold.append(np.nan)
+        else:
+            head, sub_trees = next(iter(node.items()))
+            value2code = data['value2code'][heads.index(head)]
+            feature.append(attr_heads.index(head))
+            label.append(-1)
+            keys = list(sub_trees.keys())
+            is_numeric = len(keys) == 2 and keys[0].startswith('<= ') and keys[1].startswith('> ')
+            threshold.append(float(keys[0][3:]) if is_numeric else np.nan)
+            for code, (value, sub_tree) in enumerate(sub_trees.items()):
+                branches[idx][code if is_numeric else value2code[value]] = len(nodes)
+                nodes.append(sub_tree)
+                parents.append(idx)
+        idx += 1
+
+    # a numeric node only has children 0 and 1, the width comes from the categorical attributes
+    threshold = np.array(threshold)
+    numeric_heads = [attr_heads[attr] for attr in np.unique(np.array(feature)[~np.isnan(threshold)])]
+    width = max([len(data['vocabs'][heads.index(head)]) for head in attr_heads if head not in numeric_heads] + [2])
+    children = - np.ones((len(nodes), width), dtype=np.int64)
+    for idx, branch in enumerate(branches):
+        for code, child in branch.items():
+            children[idx, code] = child
+    tree = {'attr_heads': attr_heads, 'class_vocab': data['vocabs'][class_idx],
+            'feature': np.array(feature, dtype=np.int64), 'children': children,
+            'label': np.array(label, dtype=np.int64)}
+    if numeric_heads:
+        tree['threshold'] = threshold
+        tree['numeric_heads'] = numeric_heads
+
+    # count the training rows reaching every node, chunk by chunk
+    attr_cols = [heads.index(head) for head in attr_heads]
+    attr_vocabs = [data['vocabs'][col] for col in attr_cols]
+    class_counts = np.zeros((len(nodes), len(tree['class_vocab'])))
+    if weights is not None:
+        rows = np.flatnonzero(weights)
+        codes = np.asarray(data['codes'])
+        chunks = [(codes[np.ix_(rows, attr_cols)], codes[rows, class_idx], np.asarray(weights)[rows])]
+    else:
+        chunks = ((codes[:, attr_cols], codes[:, class_idx],
+                   get_weights(data) if 'codes' in data else np.ones(len(codes))) for codes in iter_codes(data))
+    for X, labels, row_weights in chunks:
+        X = to_numbers(tree, attr_vocabs, X)
+        route_tree(tree, X, class_counts, labels.astype(np.int64), row_weights)
+    tree['class_counts'] = class_counts
+    for idx in range(len(nodes)):
+        if tree['label'][idx] < 0:
+            # an inner node no training row reached falls back to its parent
+            is_reached = class_counts[idx].any()
+            tree['label'][idx] = np.argmax(class_counts[idx]) if is_reached else tree['label'][parents[idx]]
+    return tree
+
+
+def to_numbers(tree, vocabs, X):
+    """the encoded rows `X` with the codes of the numeric attributes of `tree` replaced by their numbers
+
+    `vocabs` are the vocabularies of the columns of `X`, in the order of `tree['attr_heads']`.
+    """
+    if not tree.get('numeric_heads'):
+        return X
+    X = np.asarray(X, dtype=np.float64).copy()
+    for head in tree['numeric_heads']:
+        attr = tree['attr_heads'].index(head)
+        codes = X[:, attr].astype(np.int64)
+        is_known = (codes >= 0) & (codes < len(vocabs[attr]))
+        X[:, attr] = np.where(is_known, get_numeric_values(vocabs[attr])[np.where(is_known, codes, 0)], np.nan)
+    return X
+
+
+def route_tree(tree, X, class_counts=None, labels=None, weights=None):
+    """send the encoded rows `X` down the compiled tree level by level, return the node each row stops at
+
+    A row stops at a leaf or at a node with no child for its value (unseen or code -1).
+    The numeric columns hold numbers (see `to_numbers`, or `encode_rows` with `numeric_heads`),
+    a row with nan there stops at the numeric node.
+    When `class_counts` is given, the weighted `labels` of every visited node are added to it.
+    """
+    feature, children = tree['feature'], tree['children']
+    X = np.asarray(X)
+    nodes = np.zeros(len(X), dtype=np.int64)
+    active = np.arange(len(X))
+    while active.size:
+        if class_counts is not None:
+            np.add.at(class_counts, (nodes[active], labels[active]), weights[active])
+        cols = feature[nodes[active]]
+        is_inner = cols >= 0
+        active, cols = active[is_inner], cols[is_inner]
+        vals = X[active, cols]
+        if 'threshold' in tree:
+            thresholds = tree['threshold'][nodes[active]]
+            is_numeric = ~np.isnan(thresholds)
+            numbers = vals[is_numeric].astype(np.float64)
+            vals = np.where(is_numeric, 0, vals)
+        vals = vals.astype(np.int64)
+        is_known = (vals >= 0) & (vals < children.shape[1])
+        if 'threshold' in tree:
+            # a numeric node sends the number to child 0 (<=) or 1 (>)
+            is_known[is_numeric] = ~np.isnan(numbers)
+            vals[is_numeric] = numbers > thresholds[is_numeric]
+        next_nodes = - np.ones(len(active), dtype=np.int64)
+        next_nodes[is_known] = children[nodes[active[is_known]], vals[is_known]]
+        is_moved = next_nodes >= 0
+        active = active[is_moved]
+        nodes[active] = next_nodes[is_moved]
+    return nodes
+
+
+def predict(tree, X):
+    """class codes of the encoded rows `X` (columns in the order of `tree['attr_heads']`, numbers for the
+    columns of `tree['numeric_heads']`)"""
+    return tree['label'][route_tree(tree, X)]
+
+
+def cal_depths(children):
+    """parent and depth of every node of a compiled tree, level by level from the root"""
+    parent = - np.ones(len(children), dtype=np.int64)
+    depth = np.zeros(len(children), dtype=np.int64)
+    level, level_depth = np.zeros(1, dtype=np.int64), 0
+    while level.size:
+        level_children = children[level]
+        is_child = level_children >= 0
+        next_level = level_children[is_child]
+        parent[next_level] = np.repeat(level, is_child.sum(axis=1))
+        level_depth += 1
+        depth[next_level] = level_depth
+        level = next_level
+    return parent, depth
+
+
+def prune_tree(tree, X, labels, weights=None):
+    """reduced-error pruning of a compiled tree with the validation rows `X` and their class codes `labels`
+
+    The validation rows are routed once, counting the weighted classes reaching every node. Then,
+    bottom-up one level at a time, an inner node becomes a leaf predicting its training majority
+    when that makes no more validation errors than its subtree. Returns a new compacted tree.
+    """
+    X = np.asarray(X)
+    labels = np.asarray(labels, dtype=np.int64)
+    weights = np.ones(len(X)) if weights is None else np.asarray(weights, dtype=np.float64)
+    feature, children, label = tree['feature'], tree['children'], tree['label']
+    node_num, class_num = len(feature), len(tree['class_vocab'])
+
+    val_counts = np.zeros((node_num, class_num))
+    stops = route_tree(tree, X, val_counts, labels, weights)
+    # errors if the node was a leaf, and errors of the rows stopped at an inner node by an unseen value
+    leaf_errors = val_counts.sum(axis=1) - val_counts[np.arange(node_num), label]
+    subtree_errors = np.bincount(stops, weights=weights * (label[stops] != labels), minlength=node_num)
+
+    parent, depth = cal_depths(children)
+    is_pruned = np.zeros(node_num, dtype=bool)
+    for level_depth in range(depth.max(), -1, -1):
+        level = np.flatnonzero(depth == level_depth)
+        is_inner = feature[level] >= 0
+        is_pruned[level] = is_inner & (leaf_errors[level] <= subtree_errors[level])
+        subtree_errors[level] = np.where(is_inner & ~is_pruned[level], subtree_errors[level], leaf_errors[level])
+        if level_depth > 0:
+            np.add.at(subtree_errors, parent[level], subtree_errors[level])
+
+    # keep the nodes without a pruned ancestor, breadth first numbering is kept by the compaction
+    is_kept = np.ones(node_num, dtype=bool)
+    for level_depth in range(1, depth.max() + 1):
+        level = np.flatnonzero(depth == level_depth)
+        is_kept[level] = is_kept[parent[level]] & ~is_pruned[parent[level]]
+    new_idxs = np.cumsum(is_kept) - 1
+
+    pruned = dict(tree)
+    pruned['feature'] = np.where(is_pruned, -1, feature)[is_kept]
+    children = np.where(is_pruned[:, None] | (children < 0), -1, new_idxs[np.maximum(children, 0)])
+    pruned['children'] = children[is_kept]
+    pruned['label'] = label[is_kept]
+    for key in ('class_counts', 'threshold'):
+        if key in tree:
+            pruned[key] = tree[key][is_kept]
+    if 'threshold' in tree:
+        pruned['threshold'][pruned['feature'] < 0] = np.nan
+    return pruned
+
+
 def print_rule(rule, tap_num=0):
     prefix_tap = '\t' * tap_num
     for attr in rule.keys():
@@ -146,8 +645,14 @@ if __name__ == '__main__':
     DATA_DIR = './data'
     DATA_FILE = 'play_tennis'
     filename = os.path.join(DATA_DIR, DATA_FILE)
-    data = read_data(filename, no_use_heads=['Day'])
+    data = read_data(filename, no_use_heads=['Day'], use_cache=True)
     decision_tree = ID3(data, class_name='PlayTennis')
     print('decision tree: ', decision_tree)
     print_rule(decision_tree)
+    tree = compile_tree(decision_tree, data, class_name='PlayTennis')
+    X = data['codes'][:, [data['heads'].index(head) for head in tree['attr_heads']]]
+    labels = data['codes'][:, data['heads'].index('PlayTennis')]
+    print('train accuracy: ', np.mean(predict(tree, X) == labels))
+    pruned = prune_tree(tree, X, labels)
+    print('nodes before / after pruning: ', len(tree['feature']), len(pruned['feature']))
 
@@ -0,0 +1,188 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+algorithm introduction
+
+Description: VFDT (Hoeffding Tree), an online version of ID3 for unbounded example streams
+             1. every leaf only keeps the weighted (attribute value, class) counts of the examples reaching it
+             2. a leaf is split on the attribute with the largest information gain (the criterion of ID3)
+                once the Hoeffding bound says it is ahead of the second best one with probability 1 - delta,
+                or once the two are so close (bound < tau) that the choice does not matter
+             3. the tree is stored like a compiled ID3 tree (`feature`, `children`, `label`),
+                so `predict` of ID3 scores it directly
+"""
+
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data_stream, get_attr_heads, iter_codes
+from decision_tree.ID3 import GAIN_EPS, cal_entropy, route_tree, predict
+
+
+def init_hoeffding_tree(data, class_name='Class', delta=1e-7, tau=0.05, grace_period=200):
+    """an empty Hoeffding tree for the schema of `data`, the root is a leaf without statistics"""
+    attr_heads = get_attr_heads(data, class_name)
+    vocab_sizes = np.array([len(data['vocabs'][data['heads'].index(head)]) for head in attr_heads])
+    tree = {
+        'attr_heads': attr_heads,
+        'class_vocab': data['vocabs'][data['heads'].index(class_name)],
+        'vocab_sizes': vocab_sizes,
+        'offsets': np.concatenate([[0], np.cumsum(vocab_sizes)[:-1]]).astype(np.int64),
+        'delta': delta, 'tau': tau, 'grace_period': grace_period,
+        'node_num': 0,
+        'feature': np.zeros(0, dtype=np.int64),
+        'children': np.zeros((0, max(vocab_sizes.max(), 1)), dtype=np.int64),
+        'label': np.zeros(0, dtype=np.int64),
+        'leaves': {},
+    }
+    add_leaf(tree, label=0, attr_mask=np.ones(len(attr_heads), dtype=bool))
+    return tree
+
+
+def add_leaf(tree, label, attr_mask):
+    """append a new leaf with empty statistics, the arrays grow by doubling"""
+    node = tree['node_num']
+    if node == len(tree['feature']):
+        capacity = max(2 * node, 1)
+        tree['feature'] = np.resize(tree['feature'], capacity)
+        tree['label'] = np.resize(tree['label'], capacity)
+        children = - np.ones((capacity, tree['children'].shape[1]), dtype=np.int64)
+        children[:node] = tree['children']
+        tree['children'] = children
+    tree['feature'][node] = -1
+    tree['children'][node] = -1
+    tree['label'][node] = label
+    class_num = len(tree['class_vocab'])
+    tree['leaves'][node] = {
+        'table': np.zeros((tree['vocab_sizes'].sum(), class_num)),
+        'class_counts': np.zeros(class_num),
+        'attr_mask': attr_mask,
+        'seen': 0,
+    }
+    tree['node_num'] += 1
+    return node
+
+
+def cal_leaf_gains(tree, leaf):
+    """information gain of every attribute from the statistics of `leaf`, used attributes get -inf"""
+    table, class_counts = leaf['table'], leaf['class_counts']
+    attr_ce = np.add.reduceat(table.sum(axis=1) * cal_entropy(table), tree['offsets']) / class_counts.sum()
+    gains = cal_entropy(class_counts) - attr_ce
+    gains[~leaf['attr_mask']] = - np.inf
+    return gains
+
+
+def cal_hoeffding_bound(value_range, delta, num):
+    """with probability 1 - delta the true mean is within this bound of the mean of `num` observations"""
+    return np.sqrt(value_range ** 2 * np.log(1 / delta) / (2 * num))
+
+
+def try_split(tree, node):
+    """split the leaf `node` if the Hoeffding bound allows it, return whether it was split"""
+    leaf = tree['leaves'][node]
+    class_counts = leaf['class_counts']
+    if np.count_nonzero(class_counts) <= 1 or not leaf['attr_mask'].any():
+        return False
+    gains = cal_leaf_gains(tree, leaf)
+    order = np.argsort(-gains, kind='stable')
+    best_gain = gains[order[0]]
+    second_gain = gains[order[1]] if len(order) > 1 and np.isfinite(gains[order[1]]) else 0
+    # the information gain (natural log) ranges over [0, log(class number)]
+    bound = cal_hoeffding_bound(np.log(len(class_counts)), tree['delta'], class_counts.sum())
+    if best_gain <= GAIN_EPS or (best_gain - second_gain <= bound and bound >= tree['tau']):
+        return False
+
+    best = int(order[0])
+    child_mask = leaf['attr_mask'].copy()
+    child_mask[best] = False
+    parent_label = int(np.argmax(class_counts))
+    offset = tree['offsets'][best]
+    del tree['leaves'][node]
+    tree['feature'][node] = best
+    tree['label'][node] = parent_label
+    for val in range(tree['vocab_sizes'][best]):
+        val_counts = leaf['table'][offset + val]
+        # a new leaf predicts the class its value had at the parent until it has seen examples
+        label = int(np.argmax(val_counts)) if val_counts.any() else parent_label
+        tree['children'][node, val] = add_leaf(tree, label, child_mask)
+    return True
+
+
+def update_hoeffding_tree(tree, X, labels, weights=None):
+    """learn from one batch of encoded rows `X` (columns in the order of `tree['attr_heads']`)
+
+    The rows are sorted down to their leaves, the statistics of every reached leaf are updated
+    with one bincount, and a leaf is checked for a split every `grace_period` examples.
+    """
+    X = np.asarray(X, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    weights = np.ones(len(X)) if weights is None else np.asarray(weights, dtype=np.float64)
+    class_num = len(tree['class_vocab'])
+    nodes = route_tree(tree, X)
+    # rows stopped above a leaf by an unseen value can not be learnt from
+    is_leaf = tree['feature'][nodes] < 0
+    rows = np.arange(len(X))[is_leaf]
+    rows = rows[np.argsort(nodes[rows], kind='stable')]
+    leaf_nodes, starts = np.unique(nodes[rows], return_index=True)
+    for node, leaf_rows in zip(leaf_nodes, np.split(rows, starts[1:])):
+        leaf = tree['leaves'][node]
+        keys = (X[leaf_rows] + tree['offsets']) * class_num + labels[leaf_rows, None]
+        leaf['table'] += np.bincount(keys.ravel(), weights=np.repeat(weights[leaf_rows], X.shape[1]),
+                                     minlength=leaf['table'].size).reshape(leaf['table'].shape)
+        leaf['class_counts'] += np.bincount(labels[leaf_rows], weights=weights[leaf_rows], minlength=class_num)
+        tree['label'][node] = np.argmax(leaf['class_counts'])
+        leaf['seen'] += len(leaf_rows)
+        if leaf['seen'] >= tree['grace_period']:
+            leaf['seen'] = 0
+            try_split(tree, node)
+    return tree
+
+
+def hoeffding_tree(data, class_name='Class', delta=1e-7, tau=0.05, grace_period=200, batch_size=None):
+    """learn a Hoeffding tree from `data` in one pass, chunk by chunk, so `data` can be a stream dataset
+
+    Every chunk is fed in batches of `batch_size` (default: `grace_period`) rows, as they would arrive.
+    """
+    tree = init_hoeffding_tree(data, class_name, delta, tau, grace_period)
+    batch_size = batch_size or grace_period
+    attr_cols = [data['heads'].index(head) for head in tree['attr_heads']]
+    class_idx = data['heads'].index(class_name)
+    for codes in iter_codes(data):
+        weights = data['weights'] if 'codes' in data and 'weights' in data else None
+        for start in range(0, len(codes), batch_size):
+            batch = np.asarray(codes[start:start+batch_size])
+            batch_weights = None if weights is None else weights[start:start+batch_size]
+            update_hoeffding_tree(tree, batch[:, attr_cols], batch[:, class_idx], batch_weights)
+    return tree
+
+
+def export_tree(tree, data):
+    """convert the tree to the nested dict of ID3, e.g. for `print_rule` of ID3"""
+    root = {}
+    stack = [(0, root)]
+    while stack:
+        node, decoded = stack.pop()
+        attr = tree['feature'][node]
+        if attr < 0:
+            decoded['label'] = tree['class_vocab'][tree['label'][node]]
+            continue
+        head = tree['attr_heads'][attr]
+        vocab = data['vocabs'][data['heads'].index(head)]
+        decoded[head] = {}
+        for val in range(tree['vocab_sizes'][attr]):
+            decoded[head][vocab[val]] = {}
+            stack.append((tree['children'][node, val], decoded[head][vocab[val]]))
+    return {'Root': root}
+
+
+if __name__ == '__main__':
+    DATA_DIR = './data'
+    DATA_FILE = 'play_tennis'
+    filename = os.path.join(DATA_DIR, DATA_FILE)
+    data = read_data_stream(filename, chunk_size=4, no_use_heads=['Day'])
+    tree = hoeffding_tree(data, class_name='PlayTennis', delta=0.5, grace_period=4)
+    print('decision tree: ', export_tree(tree, data))
+    X = np.vstack([codes[:, [data['heads'].index(head) for head in tree['attr_heads']]] for codes in iter_codes(data)])
+    print('predict: ', [tree['class_vocab'][label] for label in predict(tree, X)])
@@ -2,8 +2,10 @@
 #-*- coding: utf8 -*-
 
 import os
+import sys
 import numpy as np
 import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
 from utils.plot import *
 from utils.sort import Sort
 
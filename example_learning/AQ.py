@@ -11,146 +11,266 @@ Principles: 1. Select one example from position examples from which we split all
             4. If the retained attribute values are Consistent, move it to a Consistent Set #CstSet.
             5. Specialize the retained attribute values (from one formula to two)
             6. If number(#CptSet) >= #SOL  or  number(#CstSet) >= #CONS, retain #M numbers of formula.
+Note: example sets are bitsets over the examples (`utils.coverage`), covering a rule is a chain of ANDs
+      and removing the covered positives an AND-NOT; the coverage counts of every distinct complex
+      are kept in an LRU cache until the positive examples change; `n_jobs` counts the complexes of a star
+      in worker processes, `multi_restart_AQ` runs several seeded searches at once and keeps the best cover;
+      a star only counts the complexes whose bound of positives (that of the complexes they are made of)
+      could still rank them among the #M best; the random example is drawn in proportion to the weight
+      of its row, so a dataset whose duplicate rows were collapsed learns like the raw one
 """
 
 import os
+import sys
 import math
 import random
-from collections import Counter
-
-
-def read_data(filename):
-    data = []
-    attr2value = {}
-    value2attr = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-                if attr not in value2attr:
-                    value2attr[attr] = head
-    return {'heads': heads, 'data': data, 'attr2value': attr2value, 'value2attr': value2attr}
-
-
-def div_pos_neg_data(data, class_name='Class'):
-    pos_data, neg_data = [], []
-    idx = data['heads'].index(class_name)
-    true_attr = data['data'][0][idx]
-
-    # print('true attr:', true_attr)
-
-    for attrs in data['data']:
-        if attrs[idx] == true_attr:
-            del attrs[idx]
-            pos_data.append(attrs)
-        else:
-            del attrs[idx]
-            neg_data.append(attrs)
-    return pos_data, neg_data
-
-
-def cover_examples(rule, heads, PE, NE, is_count=False):
-    # print('rule:', rule)
-    s_PE, s_NE = PE.copy(), NE.copy()
-    for head, attr in rule.items():
-        idx = heads.index(head)
-        s_PE = [item for item in s_PE if item[idx]==attr]
-        s_NE = [item for item in s_NE if item[idx]==attr]
+import multiprocessing
+import numpy as np
+from collections import Counter, OrderedDict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_vocab, get_attr_heads, div_pos_neg_data, div_pos_neg_weights, decode_rule, \
+    encode_value
+from utils.rule_set import compile_rules, predict
+from utils.coverage import build_coverage_index, cover_bits, remove_bits, count_bits, get_rows, share_index, \
+    attach_index
+from utils.shared_array import release_array
+
+CACHE_SIZE = 1 << 16  # the number of complexes whose coverage counts are kept
+BOUND_BLOCK_SIZE = 32  # the complexes of a star counted between two updates of the bound (per worker)
+
+# the state of a worker process, set once by its initializer
+WORKER = {}
+
+
+def cover_examples(rule, index, PE, NE, is_count=False):
+    """the examples of the bitsets `PE` and `NE` covered by `rule` {head: code}, or their weighted numbers"""
+    s_PE, s_NE = cover_bits(index, 'pos', rule, PE), cover_bits(index, 'neg', rule, NE)
     if is_count:
-        return len(s_PE), len(s_NE)
+        return count_bits(index, 'pos', s_PE), count_bits(index, 'neg', s_NE)
     else:
         return s_PE, s_NE
 
 
-def remove_example(org_data, rmv_data):
-    result_data = []
-    for org_item in org_data:
-        if org_item not in rmv_data:
-            result_data.append(org_item)
-    return result_data
+def init_cache(max_size=CACHE_SIZE):
+    """a bounded LRU cache of the coverage counts of complexes, with its hit statistics"""
+    return {'counts': OrderedDict(), 'max_size': max_size, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def count_cover_chunk(args):
+    """worker: the coverage counts of a chunk of complexes on the shared index"""
+    rules, PE, NE = args
+    return [cover_examples(rule, WORKER['index'], PE, NE, is_count=True) for rule in rules]
+
+
+def init_star_worker(spec):
+    WORKER['blocks'], WORKER['index'] = attach_index(spec)
+
+
+def count_star(star, index, PE, NE, cache, pool=None, n_jobs=1):
+    """the weighted numbers of examples of `PE` and `NE` covered by every complex of `star`
+
+    Each distinct complex is counted once: the key is its set of selectors, so the same conjunction
+    in another order is a hit too. The complexes not in the cache are counted together, by the
+    workers of `pool` when one is given. The cache must be cleared whenever `PE` or `NE` changes.
+    """
+    keys = [frozenset(rule.items()) for rule in star]
+    counts = cache['counts']
+    new_rules = {}
+    for key, rule in zip(keys, star):
+        if key not in counts and key not in new_rules:
+            new_rules[key] = rule
+    rules = list(new_rules.values())
+    if pool is None or len(rules) < 2 * n_jobs:
+        new_counts = [cover_examples(rule, index, PE, NE, is_count=True) for rule in rules]
+    else:
+        chunk_size = (len(rules) + n_jobs - 1) // n_jobs
+        chunks = [(rules[start:start+chunk_size], PE, NE) for start in range(0, len(rules), chunk_size)]
+        new_counts = [item for chunk_counts in pool.map(count_cover_chunk, chunks) for item in chunk_counts]
+    new_counts = dict(zip(new_rules.keys(), new_counts))
+    cache['misses'] += len(new_counts)
+    cache['hits'] += len(keys) - len(new_counts)
+
+    star_counts = []
+    for key in keys:
+        if key not in new_counts:
+            counts.move_to_end(key)
+        star_counts.append(new_counts[key] if key in new_counts else counts[key])
+    for key, value in new_counts.items():
+        counts[key] = value
+        if len(counts) > cache['max_size']:
+            counts.popitem(last=False)
+            cache['evictions'] += 1
+    return star_counts
+
+
+def get_rank(counts):
+    """the rank of a complex from its (positive, negative) coverage: fewer negatives first, then more positives"""
+    return counts[1], -counts[0]
 
 
 def sort_PS(PS):
-    PS.sort(key=lambda x: x[1][1])  # Small to Big
-    sorted_PS = []
-    PS_len = len(PS)
-    for idx, item in enumerate(PS):
-        tmp_idx = idx + 1
-        cur_pos_num = item[1][0]
-        while tmp_idx < PS_len and PS[tmp_idx][1][0] == cur_pos_num:
-            tmp_idx += 1
-        if tmp_idx > idx + 1:
-            tmp_PS = PS[idx:tmp_idx]
-            tmp_PS.sort(key=lambda x: -x[1][0])  # Big to Small
-            sorted_PS.extend(tmp_PS)
-        else:
-            sorted_PS.append(item)
-    return sorted_PS
+    return sorted(PS, key=lambda x: get_rank(x[1]))  # negatives Small to Big, then positives Big to Small
 
 
 def specialize_formula(PS, retained_formula):
+    """every retained formula conjoined with every other complex of `PS`, with the bound of its positives
+
+    All the selectors come from the same example, so a conjunction keeps the selectors of both complexes
+    and covers no more positives than either of them.
+    """
     expand_formula = []
     for idx, one_formula in enumerate(retained_formula):
         tmp_formua = retained_formula[idx:]
-        tmp_PS = [{**one_formula[0], **item[0]} for item in PS if item not in tmp_formua]
+        tmp_PS = [({**one_formula[0], **item[0]}, min(one_formula[1][0], item[1][0]))
+                  for item in PS if item not in tmp_formua]
         expand_formula.extend(tmp_PS)
     return expand_formula
 
 
-def AQ(data, Sol=2, Cons=2, M=2, class_name='Class'):
-    heads = data['heads'].copy()
-    heads.remove(class_name)
+def score_star(star, index, PE, NE, cache, M, pool=None, n_jobs=1):
+    """count the coverage of the complexes (rule, bound of its positives) of `star` worth it, return the PS
+
+    Branch and bound: the complexes are counted in blocks, the most promising first, and a complex
+    is skipped when even covering `bound` positives and no negative could not rank before the M-th
+    best complex counted so far. Complexes covering no positive are skipped as well.
+    """
+    order = sorted([idx for idx in range(len(star)) if star[idx][1] > 0], key=lambda idx: -star[idx][1])
+    block_size = BOUND_BLOCK_SIZE * (n_jobs if pool is not None else 1)
+    star_counts = {}
+    best_ranks = []
+    for start in range(0, len(order), block_size):
+        block = order[start:start+block_size]
+        if len(best_ranks) >= M:
+            block = [idx for idx in block if not best_ranks[M-1] < get_rank((star[idx][1], 0))]
+            # the bounds only get worse further on
+            if not block:
+                break
+        block_counts = count_star([star[idx][0] for idx in block], index, PE, NE, cache, pool, n_jobs)
+        star_counts.update(zip(block, block_counts))
+        best_ranks = sorted(best_ranks + [get_rank(counts) for counts in block_counts])[:M]
+    return [(star[idx][0], star_counts[idx]) for idx in sorted(star_counts)]
+
+
+def AQ(data, Sol=2, Cons=2, M=2, class_name='Class', cache=None, seed=None, n_jobs=1):
+    """learn the rules, `cache` (default: a new `init_cache()`) keeps the coverage counts and their hit statistics
+
+    The random examples are drawn by a `random.Random(seed)` (default: the `random` module);
+    `n_jobs` > 1 counts the complexes of every star in a process pool over the shared coverage index.
+    """
+    cache = init_cache() if cache is None else cache
+    rng = random if seed is None else random.Random(seed)
+    heads = get_attr_heads(data, class_name)
+    vocab_sizes = [len(get_vocab(data, head)) for head in heads]
     pos_data, neg_data = div_pos_neg_data(data, class_name)
-    pos_num = len(pos_data)
-    PE, NE = None, None
-    PE, NE = pos_data, neg_data
+    pos_weights, neg_weights = div_pos_neg_weights(data, class_name)
+    index = build_coverage_index(heads, pos_data, neg_data, pos_weights, neg_weights, vocab_sizes)
+    if n_jobs != 1:
+        blocks, spec = share_index(index)
+        pool = multiprocessing.Pool(n_jobs, initializer=init_star_worker, initargs=(spec,))
+        n_jobs = n_jobs or os.cpu_count()
+    else:
+        blocks, pool = [], None
+    try:
+        return search_rules(data, index, pos_data, pos_weights, Sol, Cons, M, cache, rng, pool, n_jobs)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for shm in blocks:
+            release_array(shm)
+
+
+def search_rules(data, index, pos_data, pos_weights, Sol, Cons, M, cache, rng, pool=None, n_jobs=1):
+    heads = index['heads']
+    pos_num = sum(pos_weights.tolist())
+    # the examples are bitsets over the rows of `pos_data` / `neg_data`
+    PE, NE = index['pos']['all'], index['neg']['all']
     CptSet = []  # complete rule set
-    while PE:
+    while PE.any():
         CstSet = []  # consistent rule set
-        # select a random example
-        random.shuffle(PE)
-        example = PE[0]
+        # select a random example, a row stands for as many examples as its weight
+        uncovered_rows = get_rows(index, 'pos', PE).tolist()
+        example_row = rng.choices(uncovered_rows, weights=pos_weights[uncovered_rows].tolist())[0]
+        example = pos_data[example_row].tolist()
+        # the counts of the previous `PE` are no longer valid
+        cache['counts'].clear()
         # print('--- example ---:', example)
         retained_formula = []
         PS = []
         while len(CstSet) < Cons:
-            expand_rule = specialize_formula(PS, retained_formula) if PS else [{head: rule} for head, rule in zip(heads, example)]
-            PS = [(one_rule, cover_examples(one_rule, heads, PE, NE, is_count=True)) for one_rule in expand_rule]
+            if PS:
+                star = specialize_formula(PS, retained_formula)
+            else:
+                star = [({head: rule}, math.inf) for head, rule in zip(heads, example)]
+            PS = score_star(star, index, PE, NE, cache, M, pool, n_jobs)
             # print('++ PS ++:', PS)
             sorted_PS = sort_PS(PS)
             selected_formula = sorted_PS[0:M]
             retained_formula = []
             for one_formula in selected_formula:
-                # if we have a complete rule, then we will finish search
-                if one_formula[1][0] == pos_num:
-                    PE = None
-                    Cons = -1
-                    CptSet = one_formula[0]
-                    break
+                # if we have a complete and consistent rule, it is the whole cover and we will finish search,
+                # a complete rule covering negatives is specialized further
+                if one_formula[1][0] == pos_num and one_formula[1][1] == 0:
+                    return [decode_rule(data, one_formula[0])]
                 # check the consistent rule
                 if one_formula[1][1] == 0:
                     CstSet.append(one_formula)
                     PS.remove(one_formula)
                     continue
                 retained_formula.append(one_formula)
-        random.shuffle(CstSet)
+        rng.shuffle(CstSet)
         candidate_rule = CstSet[0][0]
         # print('*** candidate_rule ***:', candidate_rule)
         CptSet.append(candidate_rule)
-        s_PE, _ = cover_examples(candidate_rule, heads, PE, NE)
-        PE = remove_example(PE, s_PE)
-    return CptSet
+        s_PE, _ = cover_examples(candidate_rule, index, PE, NE)
+        PE = remove_bits(PE, s_PE)
+    return [decode_rule(data, rule) for rule in CptSet]
+
+
+def evaluate_cover(rules, data, index):
+    """whether the rules {head: value} cover every positive and no negative example, and their number of selectors"""
+    pos_bits, neg_bits = index['pos']['all'] & 0, index['neg']['all'] & 0
+    for rule in rules:
+        code_rule = {head: encode_value(data, head, value) for head, value in rule.items()}
+        pos_bits |= cover_bits(index, 'pos', code_rule)
+        neg_bits |= cover_bits(index, 'neg', code_rule)
+    is_complete = not remove_bits(index['pos']['all'], pos_bits).any()
+    return is_complete, not neg_bits.any(), sum([len(rule) for rule in rules])
+
+
+def init_restart_worker(data, Sol, Cons, M, class_name):
+    WORKER.update({'data': data, 'params': (Sol, Cons, M, class_name)})
+
+
+def run_restart(seed):
+    """worker: one AQ search with its own random seed"""
+    return AQ(WORKER['data'], *WORKER['params'], seed=seed)
+
+
+def multi_restart_AQ(data, Sol=2, Cons=2, M=2, class_name='Class', restarts=8, seed=0, n_jobs=None):
+    """run `restarts` seeded AQ searches at once in a process pool, keep the most compact cover
+
+    The covers which are complete and consistent are preferred, then fewer rules, then fewer selectors.
+    """
+    rng = random.Random(seed)
+    seeds = [rng.randrange(1 << 31) for _ in range(restarts)]
+    if n_jobs == 1:
+        results = [AQ(data, Sol, Cons, M, class_name, seed=restart_seed) for restart_seed in seeds]
+    else:
+        with multiprocessing.Pool(n_jobs, initializer=init_restart_worker,
+                                  initargs=(data, Sol, Cons, M, class_name)) as pool:
+            results = pool.map(run_restart, seeds)
+
+    heads = get_attr_heads(data, class_name)
+    vocab_sizes = [len(get_vocab(data, head)) for head in heads]
+    pos_data, neg_data = div_pos_neg_data(data, class_name)
+    pos_weights, neg_weights = div_pos_neg_weights(data, class_name)
+    index = build_coverage_index(heads, pos_data, neg_data, pos_weights, neg_weights, vocab_sizes)
+    scores = []
+    for rules in results:
+        is_complete, is_consistent, selector_num = evaluate_cover(rules, data, index)
+        scores.append((not (is_complete and is_consistent), len(rules), selector_num))
+    return results[scores.index(min(scores))]
 
 
 def print_rule(rule):
@@ -172,7 +292,13 @@ if __name__ == '__main__':
     # DATA_FILE = 'weather'
     DATA_FILE = 'pneumonia'
     filename = os.path.join(DATA_DIR, DATA_FILE)
-    data = read_data(filename)
-    rule = AQ(data)
+    data = read_data(filename, use_cache=True)
+    cache = init_cache()
+    rule = AQ(data, cache=cache)
     print('result rule: ', print_rule(rule))
+    rule_set = compile_rules(rule, data)
+    X = data['codes'][:, [data['heads'].index(head) for head in rule_set['attr_heads']]]
+    labels, _ = predict(rule_set, X)
+    print('train accuracy: ', np.mean(labels == data['codes'][:, data['heads'].index('Class')]))
+    print('coverage cache: hits {}, misses {}, evictions {}'.format(cache['hits'], cache['misses'], cache['evictions']))
 
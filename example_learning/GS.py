@@ -11,151 +11,88 @@ Output: Rule
 Principles: 1. Select one attribute value which covers the most positive examples from all attribute values.
             2. Select the attribute value which covers less negative examples 
                when some attribute values cover the same positive examples
+Note: example sets are bitsets over the examples (`utils.coverage`), covering a rule is a chain of ANDs
+      and removing the covered positives an AND-NOT
 """
 
 import os
-import math
+import sys
 import random
-from collections import Counter
-
-
-def read_data(filename):
-    data = []
-    attr2value = {}
-    value2attr = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-                if attr not in value2attr:
-                    value2attr[attr] = head
-    return {'heads': heads, 'data': data, 'attr2value': attr2value, 'value2attr': value2attr}
-
-
-def flatten_arr(data):
-    if not isinstance(data[0], list):
-        return data
-    flt_data = []
-    for item in data:
-        
-        flt_data.extend(item)
-    return flt_data
-
-
-def div_pos_neg_data(data, class_name='Class'):
-    pos_data, neg_data = [], []
-    idx = data['heads'].index(class_name)
-    true_attr = data['data'][0][idx]
-
-    # print('true attr:', true_attr)
-
-    for attrs in data['data']:
-        if attrs[idx] == true_attr:
-            del attrs[idx]
-            pos_data.append(attrs)
-        else:
-            del attrs[idx]
-            neg_data.append(attrs)
-    return pos_data, neg_data
-
-
-def search_best_attr(rmv_heads, heads, PE, NE):
-    # get useful idxs
-    useful_idxs = []
-    for idx in range(len(heads)):
-        if heads[idx] not in rmv_heads:
-            useful_idxs.append(idx)
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data, get_vocab, get_attr_heads, div_pos_neg_data, div_pos_neg_weights, iter_pos_neg_data, \
+    encode_value, decode_rule
+from utils.rule_set import compile_rules, predict
+from utils.coverage import build_coverage_index, cover_bits, remove_bits, count_selectors, update_selector_counts
+
+
+def search_best_attr(rmv_heads, index, pos_counts, neg_counts, rng=random):
+    """the selector (head, code) to add to a complex, from the weighted example counts of every selector
+
+    Ties between the selectors covering as many positives and as few negatives are broken by `rng`.
+    """
+    is_usable = ~np.isin(index['selector_attrs'], [index['heads'].index(head) for head in rmv_heads])
     # find the attrs which can cover most position examples
-    flt_PE_count = Counter()
-    for idx in useful_idxs:
-        flt_PE_count += Counter(flatten_arr([heads[idx] + ':' + item[idx] for item in PE]))
-    best_attrs = []
-    max_num = 0
-    for attr, num in flt_PE_count.items():
-        if num > max_num:
-            max_num = num
-            best_attrs = [attr]
-        elif num == max_num:
-            best_attrs.append(attr)
-
-    # print('best_attrs:', best_attrs)
-
-    if len(best_attrs) == 1:
-        return best_attrs[0]
-    else:
-        # find the attrs which can cover least negative examples
-        flt_NE = [heads[idx] + ':' + item[idx] for idx in useful_idxs for item in NE]
-        select_attrs = [attr for attr in best_attrs if attr not in flt_NE]
-        if not select_attrs:
-            flt_NE_count = Counter()
-            for idx in useful_idxs:
-                flt_NE_count += Counter(flatten_arr([heads[idx] + ':' + item[idx] for item in NE]))
-            min_num = math.inf
-            for attr, num in list(flt_NE_count.items())[::-1]:
-                if attr in best_attrs:
-                    if num < min_num:
-                        min_num = num
-                        select_attrs = [attr]
-                    elif num == min_num:
-                        select_attrs.append(attr)
-        
-        # print('select_attrs:', select_attrs)
-        
-        if len(select_attrs) == 1:
-            return select_attrs[0]
-        else:
-            # if there are more than one Suitable Attrs, random select one
-            random.shuffle(select_attrs)
-            return select_attrs[0]
-
-
-def cover_examples(rule, heads, PE, NE):
-    s_PE, s_NE = PE.copy(), NE.copy()
-    for head, attr in rule.items():
-        idx = heads.index(head)
-        s_PE = [item for item in s_PE if item[idx]==attr]
-        s_NE = [item for item in s_NE if item[idx]==attr]
-    return s_PE, s_NE
-
-
-def remove_example(org_data, rmv_data):
-    result_data = []
-    for org_item in org_data:
-        if org_item not in rmv_data:
-            result_data.append(org_item)
-    return result_data
-
-
-def GS(data, class_name='Class'):
-    heads = data['heads'].copy()
-    heads.remove(class_name)
+    pos_counts = np.where(is_usable, pos_counts, 0)
+    max_num = pos_counts.max(initial=0)
+    if max_num <= 0:
+        raise ValueError('no attribute value left covers the positive examples')
+    best_selectors = np.flatnonzero(pos_counts == max_num)
+    # then the attrs which can cover least negative examples
+    best_neg_counts = neg_counts[best_selectors]
+    best_selectors = best_selectors[best_neg_counts == best_neg_counts.min()]
+    # if there are more than one Suitable Attrs, random select one
+    selector = best_selectors[rng.randrange(len(best_selectors))] if len(best_selectors) > 1 else best_selectors[0]
+    attr_idx = index['selector_attrs'][selector]
+    return index['heads'][attr_idx], int(selector - index['offsets'][attr_idx])
+
+
+def cover_examples(rule, index, PE, NE):
+    """the examples of the bitsets `PE` and `NE` covered by `rule` {head: code}"""
+    return cover_bits(index, 'pos', rule, PE), cover_bits(index, 'neg', rule, NE)
+
+
+def count_cover_examples(rule, data, class_name='Class'):
+    # count chunk by chunk, so `data` can be a stream dataset
+    heads = get_attr_heads(data, class_name)
+    idxs = [heads.index(head) for head in rule.keys()]
+    codes = [encode_value(data, head, value) for head, value in rule.items()]
+    pos_num, neg_num = 0, 0
+    for PE, NE, PW, NW in iter_pos_neg_data(data, class_name, with_weights=True):
+        pos_num += int(PW[np.all(PE[:, idxs] == codes, axis=1)].sum())
+        neg_num += int(NW[np.all(NE[:, idxs] == codes, axis=1)].sum())
+    return pos_num, neg_num
+
+
+def GS(data, class_name='Class', seed=None):
+    """learn the rules, ties between selectors are broken by a `random.Random(seed)` (default: the `random` module)"""
+    rng = random if seed is None else random.Random(seed)
+    heads = get_attr_heads(data, class_name)
+    vocab_sizes = [len(get_vocab(data, head)) for head in heads]
     F = []
     pos_data, neg_data = div_pos_neg_data(data, class_name)
-    PE, NE = None, None
-    PE, NE = pos_data, neg_data
-    while PE:
+    pos_weights, neg_weights = div_pos_neg_weights(data, class_name)
+    index = build_coverage_index(heads, pos_data, neg_data, pos_weights, neg_weights, vocab_sizes)
+    # the examples are bitsets over `pos_data` / `neg_data`, `rest_PE` holds the positives no complex covers yet;
+    # the selector counts are only counted once and then follow the examples which leave the sets
+    rest_PE = index['pos']['all']
+    rest_pos_counts = count_selectors(index, 'pos', rest_PE)
+    all_neg_counts = count_selectors(index, 'neg', index['neg']['all'])
+    while rest_PE.any():
         CPX = {}
-        while NE:
-            rmv_heads = [key.split(':')[0] for key in CPX.keys()]
-            attr = search_best_attr(rmv_heads, heads, PE, NE)
-            head, value = attr.split(':')
+        PE, NE = rest_PE, index['neg']['all']
+        pos_counts, neg_counts = rest_pos_counts, all_neg_counts
+        while NE.any():
+            head, value = search_best_attr(list(CPX.keys()), index, pos_counts, neg_counts, rng)
             CPX[head] = value
-            PE, NE = cover_examples(CPX, heads, PE, NE)
-        pos_data = remove_example(pos_data, PE)
-        PE = pos_data
-        NE = neg_data
-        F.append(CPX)
+            # `PE` and `NE` are already covered by the previous selectors of the complex
+            s_PE, s_NE = cover_examples({head: value}, index, PE, NE)
+            pos_counts = update_selector_counts(index, 'pos', pos_counts, PE, s_PE)
+            neg_counts = update_selector_counts(index, 'neg', neg_counts, NE, s_NE)
+            PE, NE = s_PE, s_NE
+        rest_pos_counts = update_selector_counts(index, 'pos', rest_pos_counts, rest_PE, remove_bits(rest_PE, PE))
+        rest_PE = remove_bits(rest_PE, PE)
+        F.append(decode_rule(data, CPX))
     return F
 
 
@@ -178,7 +115,11 @@ if __name__ == '__main__':
     # DATA_FILE = 'weather'
     DATA_FILE = 'pneumonia'
     filename = os.path.join(DATA_DIR, DATA_FILE)
-    data = read_data(filename)
+    data = read_data(filename, use_cache=True)
     rule = GS(data)
     print('result rule: ', print_rule(rule))
+    rule_set = compile_rules(rule, data)
+    X = data['codes'][:, [data['heads'].index(head) for head in rule_set['attr_heads']]]
+    labels, _ = predict(rule_set, X)
+    print('train accuracy: ', np.mean(labels == data['codes'][:, data['heads'].index('Class')]))
 
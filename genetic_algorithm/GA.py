@@ -9,10 +9,13 @@ Description: GA, a kind of genetic Algorithm
 """
 
 import os
+import sys
 import math
 import random
 import numpy as np
 from collections import namedtuple
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the repository root
+from utils.dataset import read_data
 
 MIN_NUM_RULES = 1
 MAX_NUM_RULES = 3
@@ -20,30 +23,6 @@ MAX_NUM_RULES = 3
 Hypothesis = namedtuple('Hypothesis', ['rules', 'digit_hps', 'rule_num', 'fitness'])
 
 
-def read_data(filename, no_use_heads=[]):
-    data = []
-    attr2value = {}
-    with open(filename, 'r') as fr:
-        line = fr.readline().strip()
-        heads = line.split('\t')
-        no_use_idxs = [heads.index(no_use_head) for no_use_head in no_use_heads]
-        heads = [head for head in heads if head not in no_use_heads]
-        while True:
-            line = fr.readline()
-            if not line:
-                break
-            line = line.strip()
-            attrs = line.split('\t')
-            attrs = [attr for a_idx, attr in enumerate(attrs) if a_idx not in no_use_idxs]
-            data.append(attrs)
-            for head, attr in zip(heads, attrs):
-                if head not in attr2value:
-                    attr2value[head] = set([attr])
-                else:
-                    attr2value[head].add(attr)
-    return {'heads': heads, 'data': data, 'attr2value': attr2value}
-
-
 def transfer_reps_to_digit(hps, heads, attr2value, class2digits_dict, class_name='Class'):
     if isinstance(hps, list):
         digit = []
@@ -176,9 +155,9 @@ def mutation_operator():
 
 
 def GA(data, p, r, m, class_name='Class'):
-    examples = data['data']
+    examples = data['codes'].tolist()
     heads = data['heads']
-    attr2value = data['attr2value']
+    attr2value = {head: list(range(len(vocab))) for head, vocab in zip(heads, data['vocabs'])}
 
     # generate the binary reps of class value
     class_num = len(attr2value[class_name])
@@ -0,0 +1,26 @@
+from utils.dataset import read_data
+from example_learning.AQ import AQ, multi_restart_AQ
+
+
+def write_data(tmp_path, rows):
+    filename = tmp_path / 'data'
+    filename.write_text('\n'.join('\t'.join(row) for row in rows) + '\n')
+    return read_data(str(filename))
+
+
+def test_complete_rule_is_whole_cover(tmp_path):
+    data = write_data(tmp_path, [['a', 'b', 'Class'], ['x', 'p', 'Y'], ['x', 'q', 'Y'],
+                                 ['y', 'p', 'N'], ['y', 'q', 'N']])
+    assert AQ(data, seed=0) == [{'a': 'x'}]
+    assert multi_restart_AQ(data, restarts=2, n_jobs=1) == [{'a': 'x'}]
+
+
+def test_complete_inconsistent_rule_is_specialized(tmp_path):
+    data = write_data(tmp_path, [['a', 'b', 'Class'], ['x', 'p', 'Y'], ['x', 'q', 'Y'],
+                                 ['x', 'r', 'N'], ['y', 'q', 'N']])
+    for seed in range(10):
+        rules = AQ(data, seed=seed)
+        assert {'a': 'x'} not in rules
+        covered = [any(all(row[head] == value for head, value in rule.items()) for rule in rules)
+                   for row in ({'a': 'x', 'b': 'p'}, {'a': 'x', 'b': 'q'}, {'a': 'x', 'b': 'r'}, {'a': 'y', 'b': 'q'})]
+        assert covered == [True, True, False, False]
@@ -0,0 +1,142 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+coverage bitset index
+
+Description: answer "which examples does this conjunction cover" with bitwise operations
+             1. every (attribute, value) selector gets one packed bitset over the positive examples
+                and one over the negative examples, bit i set when example i has that value
+             2. a set of examples is a bitset too, so covering a conjunction {head: code} is a chain
+                of ANDs, and removing the covered examples from a set is an AND-NOT
+             3. counting a set is a popcount, or a dot with the example weights when duplicate rows
+                were collapsed into weights
+             4. `count_selectors` counts the examples of a set having each selector at once,
+                `update_selector_counts` keeps such counts up to date while the set shrinks
+             5. `share_index` / `attach_index` hand an index to worker processes through shared memory
+"""
+
+import numpy as np
+from utils.shared_array import share_array, attach_array
+
+WORD_BITS = 64
+WORD_DTYPE = np.dtype('<u8')  # little endian, so the bytes of a word hold its bits in order
+# the number of set bits of every byte, for numpy without `bitwise_count`
+BYTE_POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def get_word_num(num):
+    return (num + WORD_BITS - 1) // WORD_BITS
+
+
+def build_side(codes, weights, offsets, val_num):
+    """the selector bitsets of one class of examples, one row of words per (attribute, value)"""
+    num = len(codes)
+    bits = np.zeros((val_num, get_word_num(num)), dtype=WORD_DTYPE)
+    rows = np.arange(num)
+    masks = np.left_shift(np.uint64(1), (rows % WORD_BITS).astype(np.uint64)).astype(WORD_DTYPE)
+    for attr_idx, offset in enumerate(offsets):
+        np.bitwise_or.at(bits, (offset + codes[:, attr_idx].astype(np.int64), rows // WORD_BITS), masks)
+    all_bits = np.zeros(get_word_num(num), dtype=WORD_DTYPE)
+    np.bitwise_or.at(all_bits, rows // WORD_BITS, masks)
+    weights = np.asarray(weights, dtype=np.float64)
+    return {'bits': bits, 'all': all_bits, 'num': num, 'weights': weights, 'codes': codes,
+            'is_unit': bool(np.all(weights == 1))}
+
+
+def build_coverage_index(heads, pos_codes, neg_codes, pos_weights, neg_weights, vocab_sizes):
+    """index the positive and negative examples (attribute codes in the order of `heads`) by selector"""
+    vocab_sizes = np.asarray(vocab_sizes, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(vocab_sizes)[:-1]]).astype(np.int64)
+    val_num = int(vocab_sizes.sum())
+    return {'heads': heads, 'vocab_sizes': vocab_sizes, 'offsets': offsets,
+            'selector_attrs': np.repeat(np.arange(len(heads)), vocab_sizes),
+            'pos': build_side(np.asarray(pos_codes), pos_weights, offsets, val_num),
+            'neg': build_side(np.asarray(neg_codes), neg_weights, offsets, val_num)}
+
+
+def get_selector(index, head, code):
+    """the row of the selector bitsets for `head` = `code`"""
+    return index['offsets'][index['heads'].index(head)] + code
+
+
+def cover_bits(index, side, rule, bits=None):
+    """the examples of `side` ('pos' or 'neg') in the bitset `bits` (default: all) covered by `rule` {head: code}"""
+    side = index[side]
+    bits = side['all'].copy() if bits is None else bits.copy()
+    for head, code in rule.items():
+        bits &= side['bits'][get_selector(index, head, code)]
+    return bits
+
+
+def remove_bits(bits, rmv_bits):
+    """the examples of `bits` which are not in `rmv_bits`"""
+    return bits & ~rmv_bits
+
+
+def popcount(bits):
+    """the number of set bits along the last axis"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return BYTE_POPCOUNT[bits.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def unpack_bits(bits, num):
+    """the bitsets as boolean masks over the `num` examples"""
+    bytes_view = np.ascontiguousarray(bits).view(np.uint8)
+    return np.unpackbits(bytes_view, axis=-1, bitorder='little')[..., :num].astype(bool)
+
+
+def count_bits(index, side, bits):
+    """the (weighted) number of examples of `side` in the bitset(s) `bits`"""
+    side = index[side]
+    if side['is_unit']:
+        return popcount(bits)
+    return unpack_bits(bits, side['num']) @ side['weights']
+
+
+def get_rows(index, side, bits):
+    """the indices of the examples of `side` in the bitset `bits`, in ascending order"""
+    return np.flatnonzero(unpack_bits(bits, index[side]['num']))
+
+
+def count_selectors(index, side, bits):
+    """the (weighted) number of examples of `side` in `bits` having every selector, one bincount over their rows"""
+    side_index = index[side]
+    rows = get_rows(index, side, bits)
+    keys = side_index['codes'][rows].astype(np.int64) + index['offsets']
+    weights = np.repeat(side_index['weights'][rows], len(index['heads']))
+    return np.bincount(keys.ravel(), weights=weights, minlength=len(index['selector_attrs']))
+
+
+def update_selector_counts(index, side, counts, bits, kept_bits):
+    """the selector counts of `kept_bits`, a subset of `bits` whose counts are `counts`
+
+    Only the rows which leave are counted and subtracted, or the kept rows counted again when they are fewer.
+    """
+    rmv_bits = remove_bits(bits, kept_bits)
+    if popcount(rmv_bits) <= popcount(kept_bits):
+        return counts - count_selectors(index, side, rmv_bits)
+    return count_selectors(index, side, kept_bits)
+
+
+def share_index(index):
+    """put the bitsets and weights of `index` into shared memory, return the blocks and a picklable spec"""
+    blocks, spec = [], dict(index)
+    for side in ('pos', 'neg'):
+        spec[side] = dict(index[side])
+        for key in ('bits', 'all', 'weights', 'codes'):
+            shm, _, spec[side][key] = share_array(index[side][key])
+            blocks.append(shm)
+    return blocks, spec
+
+
+def attach_index(spec):
+    """map an index shared by `share_index`, keep the returned blocks alive while using it"""
+    blocks, index = [], dict(spec)
+    for side in ('pos', 'neg'):
+        index[side] = dict(spec[side])
+        for key in ('bits', 'all', 'weights', 'codes'):
+            shm, index[side][key] = attach_array(spec[side][key])
+            blocks.append(shm)
+    return blocks, index
@@ -0,0 +1,452 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+shared dataset loader
+
+Description: parse the tab-separated data files once into a matrix of small integer category codes
+             1. `codes[row, col]` is the code of the value at `row` of column `heads[col]`
+             2. `vocabs[col]` maps code -> value, `value2code[col]` maps value -> code
+             3. codes are given in order of first appearance, so the first value seen gets code 0
+             4. `read_data(..., use_cache=True)` keeps the codes in `<filename>.codes.npy` and the vocabularies
+                in `<filename>.vocab.json`, later runs memory-map the codes instead of parsing the text again
+             5. `read_data(..., n_jobs=4)` parses byte ranges (or line blocks of a `.gz` file) in a process pool
+                and merges the per-chunk vocabularies, the codes are the same as those of a serial parse
+             6. `collapse_duplicates` keeps every distinct row once, with its number of occurrences in `weights`
+             7. a stream dataset only keeps the schema (heads and vocabularies) in memory,
+                its rows are re-read from the file as encoded chunks on every pass
+"""
+
+import os
+import gzip
+import json
+import math
+import hashlib
+import multiprocessing
+from array import array
+import numpy as np
+
+CACHE_VERSION = 1
+CODES_SUFFIX = '.codes.npy'
+VOCAB_SUFFIX = '.vocab.json'
+
+
+###############################################
+# loader
+###############################################
+
+def get_code_dtype(vocab_size):
+    """get the smallest unsigned dtype which can hold `vocab_size` codes"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if vocab_size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def build_dataset(heads, columns, value2code):
+    """pack the per-column code buffers into one compact matrix"""
+    vocabs = [list(one_value2code.keys()) for one_value2code in value2code]
+    dtype = get_code_dtype(max([len(vocab) for vocab in vocabs] + [1]))
+    row_num = len(columns[0]) if columns else 0
+    codes = np.empty((row_num, len(heads)), dtype=dtype)
+    for col, column in enumerate(columns):
+        codes[:, col] = np.frombuffer(column, dtype=np.uint32)
+    return {'heads': heads, 'codes': codes, 'vocabs': vocabs, 'value2code': value2code}
+
+
+def open_data_file(filename):
+    """open a text data file, `.gz` files are decompressed on the fly"""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', encoding='utf8')
+    return open(filename, 'r', encoding='utf8')
+
+
+def read_heads(fr, no_use_heads=[]):
+    """read the head line, return the used heads and their column indexes"""
+    heads = fr.readline().strip().split('\t')
+    use_idxs = [idx for idx, head in enumerate(heads) if head not in no_use_heads]
+    return [heads[idx] for idx in use_idxs], use_idxs
+
+
+def encode_lines(lines, use_idxs):
+    """encode text lines column by column, codes are given in order of first appearance"""
+    value2code = [{} for _ in use_idxs]
+    columns = [array('I') for _ in use_idxs]
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        attrs = line.split('\t')
+        for col, idx in enumerate(use_idxs):
+            attr = attrs[idx]
+            code = value2code[col].get(attr)
+            if code is None:
+                code = len(value2code[col])
+                value2code[col][attr] = code
+            columns[col].append(code)
+    return value2code, columns
+
+
+def read_data(filename, no_use_heads=[], use_cache=False, n_jobs=1):
+    """read the tab-separated file `filename` into an integer-encoded dataset"""
+    if use_cache:
+        data = load_cache(filename, no_use_heads)
+        if data is None:
+            data = read_data(filename, no_use_heads, n_jobs=n_jobs)
+            save_cache(filename, data, no_use_heads)
+            data = load_cache(filename, no_use_heads)
+        return data
+    if n_jobs != 1:
+        return read_data_parallel(filename, no_use_heads, n_jobs=n_jobs)
+    with open_data_file(filename) as fr:
+        heads, use_idxs = read_heads(fr, no_use_heads)
+        value2code, columns = encode_lines(fr, use_idxs)
+    return build_dataset(heads, columns, value2code)
+
+
+###############################################
+# parallel loader
+###############################################
+
+def parse_lines(args):
+    """worker: encode a block of lines with a local vocabulary"""
+    lines, use_idxs = args
+    value2code, columns = encode_lines(lines, use_idxs)
+    vocabs = [list(one_value2code.keys()) for one_value2code in value2code]
+    codes = np.stack([np.frombuffer(column, dtype=np.uint32) for column in columns], axis=1)
+    return vocabs, codes
+
+
+def iter_byte_range_lines(filename, start, end):
+    """yield the lines which begin inside the byte range [start, end) of `filename`"""
+    with open(filename, 'rb') as fr:
+        # the line crossing `start` belongs to the previous range
+        fr.seek(start - 1)
+        if fr.read(1) != b'\n':
+            fr.readline()
+        while fr.tell() < end:
+            line = fr.readline()
+            if not line:
+                break
+            yield line.decode('utf8')
+
+
+def parse_byte_range(args):
+    """worker: encode the lines of one byte range with a local vocabulary"""
+    filename, start, end, use_idxs = args
+    return parse_lines((iter_byte_range_lines(filename, start, end), use_idxs))
+
+
+def iter_line_blocks(fr, use_idxs, block_bytes):
+    """cut a sequential (e.g. gzip) stream into blocks of about `block_bytes` characters"""
+    lines, size = [], 0
+    for line in fr:
+        lines.append(line)
+        size += len(line)
+        if size >= block_bytes:
+            yield lines, use_idxs
+            lines, size = [], 0
+    if lines:
+        yield lines, use_idxs
+
+
+def merge_chunks(chunks, col_num):
+    """re-map the local codes of every chunk to one global encoding
+
+    The chunks are merged in file order, so the global codes are the same as those of a serial parse.
+    """
+    value2code = [{} for _ in range(col_num)]
+    lookups = []
+    for vocabs, _ in chunks:
+        chunk_lookups = []
+        for col, vocab in enumerate(vocabs):
+            lookup = np.empty(len(vocab), dtype=np.uint32)
+            for local_code, value in enumerate(vocab):
+                code = value2code[col].get(value)
+                if code is None:
+                    code = len(value2code[col])
+                    value2code[col][value] = code
+                lookup[local_code] = code
+            chunk_lookups.append(lookup)
+        lookups.append(chunk_lookups)
+    vocab_size = max([len(one_value2code) for one_value2code in value2code] + [1])
+    row_num = sum([len(codes) for _, codes in chunks])
+    all_codes = np.empty((row_num, col_num), dtype=get_code_dtype(vocab_size))
+    row = 0
+    for (_, codes), chunk_lookups in zip(chunks, lookups):
+        for col, lookup in enumerate(chunk_lookups):
+            all_codes[row:row + len(codes), col] = lookup[codes[:, col]]
+        row += len(codes)
+    return all_codes, value2code
+
+
+def read_data_parallel(filename, no_use_heads=[], n_jobs=None, chunk_bytes=1 << 26):
+    """parse `filename` in chunks with a process pool, then merge the per-chunk vocabularies"""
+    n_jobs = n_jobs or os.cpu_count()
+    with open_data_file(filename) as fr:
+        heads, use_idxs = read_heads(fr, no_use_heads)
+    with multiprocessing.Pool(n_jobs) as pool:
+        if filename.endswith('.gz'):
+            # a gzip stream can not be seeked, so the main process cuts it into line blocks
+            with open_data_file(filename) as fr:
+                fr.readline()
+                chunks = list(pool.imap(parse_lines, iter_line_blocks(fr, use_idxs, chunk_bytes)))
+        else:
+            with open(filename, 'rb') as fr:
+                fr.readline()
+                body_start = fr.tell()
+            body_size = os.path.getsize(filename) - body_start
+            range_num = max(n_jobs, math.ceil(body_size / chunk_bytes))
+            bounds = [body_start + body_size * idx // range_num for idx in range(range_num + 1)]
+            ranges = [(filename, start, end, use_idxs) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+            chunks = pool.map(parse_byte_range, ranges)
+    chunks = [chunk for chunk in chunks if len(chunk[1])]
+    codes, value2code = merge_chunks(chunks, len(heads))
+    vocabs = [list(one_value2code.keys()) for one_value2code in value2code]
+    return {'heads': heads, 'codes': codes, 'vocabs': vocabs, 'value2code': value2code}
+
+
+###############################################
+# binary cache
+###############################################
+
+def get_file_hash(filename, block_size=1 << 20):
+    """sha1 of the whole content of `filename`"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fr:
+        block = fr.read(block_size)
+        while block:
+            sha1.update(block)
+            block = fr.read(block_size)
+    return sha1.hexdigest()
+
+
+def write_cache_header(vocab_file, header):
+    """write the header of a cache next to it and move it over the old one, a reader never sees half a file"""
+    tmp_vocab = '{}.{}.tmp'.format(vocab_file, os.getpid())
+    with open(tmp_vocab, 'w') as fw:
+        json.dump(header, fw, ensure_ascii=False)
+    os.replace(tmp_vocab, vocab_file)
+
+
+def save_cache(filename, data, no_use_heads=[]):
+    """write the codes and vocabularies of `data` next to the source file `filename`"""
+    stat = os.stat(filename)
+    header = {
+        'version': CACHE_VERSION,
+        'source': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': get_file_hash(filename)},
+        'no_use_heads': list(no_use_heads),
+        'heads': data['heads'],
+        'vocabs': data['vocabs'],
+    }
+    # write to temporary files of this process first, so a reader never sees half a cache
+    # and processes saving the same cache at once do not share them
+    tmp_codes = '{}{}.{}.tmp'.format(filename, CODES_SUFFIX, os.getpid())
+    with open(tmp_codes, 'wb') as fw:
+        np.save(fw, data['codes'])
+    os.replace(tmp_codes, filename + CODES_SUFFIX)
+    write_cache_header(filename + VOCAB_SUFFIX, header)
+
+
+def load_cache(filename, no_use_heads=[]):
+    """memory-map the cache of `filename`, return None when it is missing or stale"""
+    codes_file, vocab_file = filename + CODES_SUFFIX, filename + VOCAB_SUFFIX
+    if not os.path.exists(codes_file) or not os.path.exists(vocab_file):
+        return None
+    with open(vocab_file, 'r') as fr:
+        header = json.load(fr)
+    if header.get('version') != CACHE_VERSION or header['no_use_heads'] != list(no_use_heads):
+        return None
+    stat, source = os.stat(filename), header['source']
+    if stat.st_size != source['size']:
+        return None
+    # the mtime may change without the content changing (copy, touch), only then pay for the hash
+    if stat.st_mtime_ns != source['mtime_ns']:
+        if get_file_hash(filename) != source['sha1']:
+            return None
+        source['mtime_ns'] = stat.st_mtime_ns
+        write_cache_header(vocab_file, header)
+    codes = np.load(codes_file, mmap_mode='r')
+    vocabs = header['vocabs']
+    value2code = [{value: code for code, value in enumerate(vocab)} for vocab in vocabs]
+    return {'heads': header['heads'], 'codes': codes, 'vocabs': vocabs, 'value2code': value2code}
+
+
+###############################################
+# stream loader
+###############################################
+
+def read_schema(filename, no_use_heads=[]):
+    """first pass over `filename`, only collect the heads and vocabularies"""
+    with open_data_file(filename) as fr:
+        heads, use_idxs = read_heads(fr, no_use_heads)
+        value2code = [{} for _ in heads]
+        for line in fr:
+            line = line.strip()
+            if not line:
+                continue
+            attrs = line.split('\t')
+            for col, idx in enumerate(use_idxs):
+                attr = attrs[idx]
+                if attr not in value2code[col]:
+                    value2code[col][attr] = len(value2code[col])
+    vocabs = [list(one_value2code.keys()) for one_value2code in value2code]
+    return {'heads': heads, 'vocabs': vocabs, 'value2code': value2code}
+
+
+def iter_chunks(filename, schema, chunk_size=65536):
+    """yield the rows of `filename` encoded by `schema`, at most `chunk_size` rows at a time"""
+    value2code = schema['value2code']
+    dtype = get_code_dtype(max([len(vocab) for vocab in schema['vocabs']] + [1]))
+    with open_data_file(filename) as fr:
+        file_heads, _ = read_heads(fr)
+        use_idxs = [file_heads.index(head) for head in schema['heads']]
+        chunk = np.empty((chunk_size, len(use_idxs)), dtype=dtype)
+        row_num = 0
+        for line in fr:
+            line = line.strip()
+            if not line:
+                continue
+            attrs = line.split('\t')
+            try:
+                chunk[row_num] = [value2code[col][attrs[idx]] for col, idx in enumerate(use_idxs)]
+            except KeyError as err:
+                raise ValueError('value {} is not in the schema of {}'.format(err, filename))
+            row_num += 1
+            if row_num == chunk_size:
+                yield chunk.copy()
+                row_num = 0
+        if row_num:
+            yield chunk[:row_num].copy()
+
+
+def read_data_stream(filename, chunk_size=65536, no_use_heads=[], schema=None):
+    """open `filename` as a stream dataset, the vocabularies come from `schema` or a first pass"""
+    if schema is None:
+        schema = read_schema(filename, no_use_heads)
+    return {'heads': schema['heads'], 'vocabs': schema['vocabs'], 'value2code': schema['value2code'],
+            'filename': filename, 'chunk_size': chunk_size}
+
+
+def iter_codes(data):
+    """yield the code matrix of `data` chunk by chunk, a loaded dataset is one chunk"""
+    if 'codes' in data:
+        yield data['codes']
+    else:
+        yield from iter_chunks(data['filename'], data, data['chunk_size'])
+
+
+###############################################
+# duplicate collapsing
+###############################################
+
+def collapse_duplicates(data):
+    """keep each distinct row once (in order of first appearance), its count goes to `weights`"""
+    codes = np.asarray(data['codes'])
+    _, first_idxs, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    weights = np.zeros(len(first_idxs), dtype=np.int64)
+    np.add.at(weights, inverse, get_weights(data))
+    order = np.argsort(first_idxs, kind='stable')
+    return {'heads': data['heads'], 'codes': codes[first_idxs[order]], 'vocabs': data['vocabs'],
+            'value2code': data['value2code'], 'weights': weights[order]}
+
+
+def get_weights(data):
+    """get the example weights, every row counts once when `data` is not collapsed"""
+    if 'weights' in data:
+        return data['weights']
+    return np.ones(len(data['codes']), dtype=np.int64)
+
+
+###############################################
+# toolkit method
+###############################################
+
+def get_vocab(data, head):
+    """get the values of column `head`, indexed by code"""
+    return data['vocabs'][data['heads'].index(head)]
+
+
+def encode_value(data, head, value):
+    """get the code of `value` in column `head`"""
+    return data['value2code'][data['heads'].index(head)][value]
+
+
+def decode_value(data, head, code):
+    """get the value of `code` in column `head`"""
+    return get_vocab(data, head)[code]
+
+
+def decode_rule(data, rule):
+    """decode a conjunctive rule {head: code} to {head: value}"""
+    return {head: decode_value(data, head, code) for head, code in rule.items()}
+
+
+def parse_number(value):
+    """the number written by a value, nan when it is not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def encode_rows(data, heads, rows, numeric_heads=()):
+    """encode rows of values of the columns `heads`, a value outside the vocabulary gets code -1
+
+    The columns of `numeric_heads` keep their numbers instead of codes (nan for a value which is not a number),
+    so a number never seen in training can still be compared with a threshold; the rows are then floats.
+    """
+    value2codes = [data['value2code'][data['heads'].index(head)] for head in heads]
+    is_numeric = [head in numeric_heads for head in heads]
+    codes = np.empty((len(rows), len(heads)), dtype=np.float64 if any(is_numeric) else np.int64)
+    for row_idx, row in enumerate(rows):
+        codes[row_idx] = [parse_number(value) if numeric else value2code.get(value, -1)
+                          for value2code, numeric, value in zip(value2codes, is_numeric, row)]
+    return codes
+
+
+def get_attr_heads(data, class_name='Class'):
+    """get all heads except the class head"""
+    return [head for head in data['heads'] if head != class_name]
+
+
+def div_pos_neg_data(data, class_name='Class', true_code=None):
+    """split the rows by class, the class `true_code` (default: class of the first row) is positive"""
+    class_idx = data['heads'].index(class_name)
+    codes = data['codes']
+    if true_code is None:
+        true_code = codes[0, class_idx]
+    attr_idxs = [idx for idx in range(codes.shape[1]) if idx != class_idx]
+    is_pos = codes[:, class_idx] == true_code
+    attr_codes = codes[:, attr_idxs]
+    return attr_codes[is_pos], attr_codes[~is_pos]
+
+
+def div_pos_neg_weights(data, class_name='Class', true_code=None):
+    """split the example weights by class like `div_pos_neg_data`"""
+    class_idx = data['heads'].index(class_name)
+    codes = data['codes']
+    if true_code is None:
+        true_code = codes[0, class_idx]
+    is_pos = codes[:, class_idx] == true_code
+    weights = get_weights(data)
+    return weights[is_pos], weights[~is_pos]
+
+
+def iter_pos_neg_data(data, class_name='Class', with_weights=False):
+    """split every chunk of `data` by class like `div_pos_neg_data`, optionally with the weights"""
+    class_idx = data['heads'].index(class_name)
+    true_code = None
+    for codes in iter_codes(data):
+        if true_code is None:
+            true_code = codes[0, class_idx]
+        chunk = {'heads': data['heads'], 'codes': codes}
+        if 'codes' in data and 'weights' in data:
+            chunk['weights'] = data['weights']
+        pos_codes, neg_codes = div_pos_neg_data(chunk, class_name, true_code)
+        if with_weights:
+            pos_weights, neg_weights = div_pos_neg_weights(chunk, class_name, true_code)
+            yield pos_codes, neg_codes, pos_weights, neg_weights
+        else:
+            yield pos_codes, neg_codes
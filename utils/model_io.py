@@ -0,0 +1,157 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+model file toolkit
+
+Description: keep learned models in one versioned binary file which a serving process memory-maps
+             1. a file is the magic bytes, the length of a JSON header, the header, then raw arrays
+                aligned to 64 bytes, the header holds the model kind, its small metadata
+                (heads, vocabularies) and the dtype, shape and offset of every array
+             2. `load_model` maps the file read only, so loading costs no parsing and the pages
+                are shared by every process which loads the same file
+             3. trees are saved compiled (`compile_tree` of ID3, or a VFDT tree), rules of GS/AQ compiled
+                (`utils.rule_set`), the boundaries of CE as hypothesis matrices of codes with the sentinels
+                of CE, the projection `best_W` of PCA as it is
+"""
+
+import os
+import json
+import numpy as np
+from utils.dataset import get_attr_heads, get_vocab
+
+MODEL_MAGIC = b'PRMLMODL'
+MODEL_VERSION = 1
+ALIGN = 64
+
+# the sentinels of a hypothesis, as in concept_learning/CE.py: no value at all, and any value
+EMPTY = -1
+ANY = -2
+
+TREE_ARRAYS = ['feature', 'children', 'label', 'class_counts', 'threshold']
+
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def save_model(filename, kind, meta, arrays):
+    """write the arrays (a dict name -> ndarray) and the JSON-able `meta` of a model of type `kind`"""
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError('array {} has objects, which can not be memory-mapped'.format(name))
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = align(offset + array.nbytes)
+    header = json.dumps({'version': MODEL_VERSION, 'kind': kind, 'meta': meta, 'arrays': specs},
+                        ensure_ascii=False).encode('utf8')
+    data_start = align(len(MODEL_MAGIC) + 8 + len(header))
+
+    # written next to the target and moved over it, a reader never sees half a file
+    tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmp_filename, 'wb') as fw:
+        fw.write(MODEL_MAGIC)
+        fw.write(np.uint64(len(header)).tobytes())
+        fw.write(header)
+        for name, array in arrays.items():
+            fw.seek(data_start + specs[name]['offset'])
+            fw.write(array.tobytes())
+        fw.truncate(data_start + offset)
+    os.replace(tmp_filename, filename)
+
+
+def read_header(filename):
+    """read and check the header of a model file, return it and the offset of its first array"""
+    with open(filename, 'rb') as fr:
+        magic = fr.read(len(MODEL_MAGIC))
+        if magic != MODEL_MAGIC:
+            raise ValueError('{} is not a model file'.format(filename))
+        header_len = int(np.frombuffer(fr.read(8), dtype=np.uint64)[0])
+        header = json.loads(fr.read(header_len).decode('utf8'))
+    if header['version'] != MODEL_VERSION:
+        raise ValueError('{} has model version {}, expected {}'.format(filename, header['version'], MODEL_VERSION))
+    return header, align(len(MODEL_MAGIC) + 8 + header_len)
+
+
+def load_model(filename, kind=None, mmap=True):
+    """read a model file, return its metadata and its arrays (read-only views of the mapped file)"""
+    header, data_start = read_header(filename)
+    if kind is not None and header['kind'] != kind:
+        raise ValueError('{} holds a {} model, expected {}'.format(filename, header['kind'], kind))
+
+    if mmap:
+        buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+    else:
+        buffer = np.fromfile(filename, dtype=np.uint8)
+        buffer.flags.writeable = False
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        size = int(np.prod(spec['shape'], dtype=np.int64)) * dtype.itemsize
+        arrays[name] = buffer[start:start+size].view(dtype).reshape(spec['shape'])
+    return header['meta'], arrays
+
+
+def save_tree(filename, tree, data=None):
+    """save a compiled tree (`compile_tree`, `prune_tree` of ID3 or a VFDT tree)
+
+    With the dataset `data` the vocabularies of the attributes are kept too, so rows of values can be encoded.
+    """
+    # a VFDT tree grows its arrays by doubling, only the first `node_num` nodes are used
+    node_num = tree.get('node_num', len(tree['feature']))
+    arrays = {}
+    for name in TREE_ARRAYS:
+        if name in tree:
+            arrays[name] = tree[name][:node_num]
+    meta = {'attr_heads': tree['attr_heads'], 'class_vocab': tree['class_vocab'],
+            'numeric_heads': tree.get('numeric_heads', [])}
+    if data is not None:
+        meta['vocabs'] = [get_vocab(data, head) for head in tree['attr_heads']]
+    save_model(filename, 'tree', meta, arrays)
+
+
+def load_tree(filename, mmap=True):
+    """load a tree saved by `save_tree`, ready for `predict` of ID3"""
+    meta, arrays = load_model(filename, 'tree', mmap)
+    return dict(meta, **arrays)
+
+
+def save_rules(filename, rule_set):
+    """save a rule set of GS or AQ compiled by `utils.rule_set.compile_rules`"""
+    meta = {key: value for key, value in rule_set.items() if key != 'conditions'}
+    save_model(filename, 'rules', meta, {'conditions': np.asarray(rule_set['conditions'], dtype=np.int32)})
+
+
+def load_rules(filename, mmap=True):
+    """load a rule set saved by `save_rules`, ready for `predict` of `utils.rule_set`"""
+    meta, arrays = load_model(filename, 'rules', mmap)
+    return dict(meta, **arrays)
+
+
+def save_version_space(filename, G_Set, S_Set, data, class_name='Class'):
+    """save the general and special boundaries of CE, hypotheses of codes with the sentinels EMPTY and ANY"""
+    attr_heads = get_attr_heads(data, class_name)
+    arrays = {'G': np.array(G_Set, dtype=np.int32).reshape(len(G_Set), len(attr_heads)),
+              'S': np.array(S_Set, dtype=np.int32).reshape(len(S_Set), len(attr_heads))}
+    meta = {'attr_heads': attr_heads, 'vocabs': [get_vocab(data, head) for head in attr_heads]}
+    save_model(filename, 'version_space', meta, arrays)
+
+
+def load_version_space(filename, mmap=True):
+    """load the boundaries saved by `save_version_space`, `G` and `S` hold one hypothesis per row"""
+    meta, arrays = load_model(filename, 'version_space', mmap)
+    return dict(meta, **arrays)
+
+
+def save_projection(filename, W):
+    """save the projection matrix `best_W` of PCA"""
+    save_model(filename, 'projection', {}, {'W': np.asarray(W)})
+
+
+def load_projection(filename, mmap=True):
+    """load the projection saved by `save_projection`, as `W`"""
+    meta, arrays = load_model(filename, 'projection', mmap)
+    return dict(meta, **arrays)
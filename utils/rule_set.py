@@ -0,0 +1,74 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+rule set classifier
+
+Description: apply the disjunctive rule sets of GS and AQ to whole encoded batches
+             1. `compile_rules` turns the rules [{head: value}, ...] into a matrix of required codes,
+                one row per rule and one column per attribute, ANY where a rule has no condition
+             2. `predict` checks every rule against every row with one comparison per constrained
+                attribute over a (rows, rules) mask, a row gets the class of the rules when one fires
+             3. batches are scored in chunks of rows, so the mask stays small whatever the batch size
+"""
+
+import numpy as np
+from utils.dataset import get_attr_heads, get_vocab, encode_value, iter_codes
+from utils.model_io import ANY
+
+MASK_CELLS = 1 << 22  # the largest (rows, rules) mask evaluated at once
+
+
+def compile_rules(rules, data, class_name='Class'):
+    """compile the rules of GS or AQ, which cover the positive class of `data` (the class of its first row)"""
+    attr_heads = get_attr_heads(data, class_name)
+    conditions = np.full((len(rules), len(attr_heads)), ANY, dtype=np.int32)
+    for rule_idx, rule in enumerate(rules):
+        for head, value in rule.items():
+            conditions[rule_idx, attr_heads.index(head)] = encode_value(data, head, value)
+    class_vocab = get_vocab(data, class_name)
+    first_codes = next(iter_codes(data))
+    return {'attr_heads': attr_heads, 'vocabs': [get_vocab(data, head) for head in attr_heads],
+            'class_name': class_name, 'class_vocab': class_vocab,
+            'label': class_vocab[int(first_codes[0, data['heads'].index(class_name)])],
+            'conditions': conditions}
+
+
+def decode_rules(rule_set):
+    """the rules of a compiled rule set as the list of {head: value} given by GS and AQ"""
+    rules = []
+    for conditions in rule_set['conditions']:
+        rules.append({head: vocab[code] for head, vocab, code in zip(rule_set['attr_heads'], rule_set['vocabs'],
+                                                                     conditions) if code != ANY})
+    return rules
+
+
+def match_rules(conditions, X):
+    """the (rows, rules) mask of the rules whose conditions every row of `X` meets"""
+    is_met = np.ones((len(X), len(conditions)), dtype=bool)
+    for attr_idx in np.flatnonzero((conditions != ANY).any(axis=0)):
+        attr_conditions = conditions[:, attr_idx]
+        is_met &= (attr_conditions == ANY) | (X[:, attr_idx, None] == attr_conditions)
+    return is_met
+
+
+def predict(rule_set, X):
+    """the class codes of the encoded rows `X` (columns in the order of `rule_set['attr_heads']`) and the rules fired
+
+    A row covered by some rule gets the class of the rules and the index of the first covering rule, the
+    other rows get the other class when there are two, else -1, and rule -1.
+    """
+    X = np.asarray(X)
+    conditions = np.asarray(rule_set['conditions'])
+    class_vocab = rule_set['class_vocab']
+    pos_label = class_vocab.index(rule_set['label'])
+    neg_label = 1 - pos_label if len(class_vocab) == 2 else -1
+
+    fired = - np.ones(len(X), dtype=np.int64)
+    chunk_rows = max(1, MASK_CELLS // max(1, len(conditions)))
+    for start in range(0, len(X), chunk_rows):
+        is_met = match_rules(conditions, X[start:start+chunk_rows])
+        is_fired = is_met.any(axis=1)
+        fired[start:start+chunk_rows][is_fired] = np.argmax(is_met[is_fired], axis=1)
+    labels = np.where(fired >= 0, pos_label, neg_label)
+    return labels, fired
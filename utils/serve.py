@@ -0,0 +1,258 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+micro-batching prediction service
+
+Description: serve the models saved by `utils.model_io` (trees and rule sets) over HTTP or a unix socket
+             1. every request scores one row: POST /predict/<model> with a JSON object {head: value}
+                or a list of values in the order of the attribute heads, the answer is {"label": ...}
+             2. the requests of a model wait in a queue, one batching task takes up to `max_batch_size`
+                of them, waiting at most `max_delay` seconds after the first, and scores them in one
+                vectorized call in a worker thread
+             3. GET /stats returns the counters of every model: requests, batches, errors,
+                mean batch size, throughput and the latency percentiles of the recent requests
+
+Usage: PYTHONPATH=. python utils/serve.py --port 8000 play_tennis=./play_tennis.model
+"""
+
+import time
+import json
+import asyncio
+import argparse
+from collections import deque
+import numpy as np
+from utils.dataset import parse_number
+from utils.model_io import read_header, load_model
+from utils.rule_set import predict as predict_rules
+from decision_tree.ID3 import predict
+
+LATENCY_WINDOW = 10000  # the latency percentiles are taken over this many recent requests
+MAX_BODY_BYTES = 1 << 20
+
+
+def load_served_model(filename):
+    """load a saved tree or rule set with what is needed to encode and score rows"""
+    meta, arrays = load_model(filename)
+    model = dict(meta, **arrays)
+    model['kind'] = read_header(filename)[0]['kind']
+    model['value2codes'] = [{value: code for code, value in enumerate(vocab)} for vocab in meta.get('vocabs', [])]
+    return model
+
+
+def encode_row(model, row):
+    """the codes of one request row, a value outside the vocabulary gets code -1
+
+    The numeric attributes of a tree keep their numbers (nan when a value is not a number).
+    """
+    heads = model['attr_heads']
+    if isinstance(row, dict):
+        row = [row.get(head) for head in heads]
+    if len(row) != len(heads):
+        raise ValueError('expected {} values, got {}'.format(len(heads), len(row)))
+    numeric_heads = model.get('numeric_heads', [])
+    if not model['value2codes']:
+        # a model saved without vocabularies only takes codes
+        return [parse_number(value) if head in numeric_heads else int(value) for head, value in zip(heads, row)]
+    return [parse_number(value) if head in numeric_heads else value2code.get(value, -1)
+            for head, value2code, value in zip(heads, model['value2codes'], row)]
+
+
+def score_batch(model, X):
+    """the labels of the encoded rows `X`"""
+    X = np.asarray(X, dtype=np.float64 if model.get('numeric_heads') else np.int64)
+    X = X.reshape(len(X), len(model['attr_heads']))
+    if model['kind'] == 'tree':
+        return [model['class_vocab'][label] for label in predict(model, X)]
+    if model['kind'] == 'rules':
+        # without a single other class the rows no rule covers get no label
+        labels, _ = predict_rules(model, X)
+        return [model['class_vocab'][label] if label >= 0 else None for label in labels]
+    raise ValueError('a {} model can not be served'.format(model['kind']))
+
+
+def init_stats():
+    return {'requests': 0, 'batches': 0, 'rows': 0, 'errors': 0,
+            'latencies': deque(maxlen=LATENCY_WINDOW), 'start_time': time.time()}
+
+
+def report_stats(stats):
+    latencies = np.array(stats['latencies']) * 1000
+    elapsed = time.time() - stats['start_time']
+    report = {key: stats[key] for key in ('requests', 'batches', 'rows', 'errors')}
+    report['mean_batch_size'] = stats['rows'] / stats['batches'] if stats['batches'] else 0
+    report['requests_per_second'] = stats['requests'] / elapsed if elapsed > 0 else 0
+    for percent in (50, 90, 99):
+        report['latency_p{}_ms'.format(percent)] = float(np.percentile(latencies, percent)) if latencies.size else 0
+    return report
+
+
+async def batch_loop(model, queue, stats, max_batch_size, max_delay):
+    """take the waiting requests of one model in batches and answer them"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + max_delay
+        while len(batch) < max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # drop the requests whose client has gone away
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            continue
+        try:
+            labels = await loop.run_in_executor(None, score_batch, model, [codes for codes, _ in batch])
+        except Exception as error:
+            labels, failure = [None] * len(batch), error
+        else:
+            failure = None
+            stats['batches'] += 1
+            stats['rows'] += len(batch)
+        # a request may have been cancelled while its batch was scored, the others still get their answer
+        for (_, future), label in zip(batch, labels):
+            if future.done():
+                continue
+            try:
+                if failure is not None:
+                    future.set_exception(failure)
+                else:
+                    future.set_result(label)
+            except asyncio.InvalidStateError:
+                pass
+
+
+async def predict_row(service, name, row):
+    """score one row with the model `name`, waiting for the batch it is put into"""
+    if name not in service['models']:
+        raise KeyError('unknown model {}'.format(name))
+    model, queue, stats = service['models'][name], service['queues'][name], service['stats'][name]
+    start = time.perf_counter()
+    stats['requests'] += 1
+    future = asyncio.get_running_loop().create_future()
+    try:
+        await queue.put((encode_row(model, row), future))
+        return await future
+    except Exception:
+        stats['errors'] += 1
+        raise
+    finally:
+        stats['latencies'].append(time.perf_counter() - start)
+
+
+async def read_request(reader):
+    """read one HTTP/1.1 request, return (method, path, headers, body) or None at the end of the stream"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    body_len = int(headers.get('content-length', 0))
+    if body_len > MAX_BODY_BYTES:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(body_len) if body_len else b''
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf8')
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                 .format(status, reasons[status], len(body), 'keep-alive' if keep_alive else 'close')
+                 .encode('latin-1') + body)
+
+
+async def handle_connection(service, reader, writer):
+    """answer the requests of one (keep-alive) connection in turn"""
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as error:
+                write_response(writer, 400, {'error': str(error)}, keep_alive=False)
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            if method == 'POST' and path.startswith('/predict/'):
+                try:
+                    label = await predict_row(service, path[len('/predict/'):], json.loads(body or b'null'))
+                    status, payload = 200, {'label': label}
+                except KeyError as error:
+                    status, payload = 404, {'error': error.args[0]}
+                except (ValueError, TypeError) as error:
+                    status, payload = 400, {'error': str(error)}
+                except Exception as error:
+                    status, payload = 500, {'error': str(error)}
+            elif method == 'GET' and path == '/stats':
+                status, payload = 200, {name: report_stats(stats) for name, stats in service['stats'].items()}
+            else:
+                status, payload = 404, {'error': 'no route {} {}'.format(method, path)}
+            write_response(writer, status, payload, keep_alive)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_service(model_files, host='127.0.0.1', port=8000, unix_path=None, max_batch_size=256,
+                        max_delay=0.002):
+    """load the models {name: filename}, start their batching tasks and the server, return the service"""
+    service = {'models': {}, 'queues': {}, 'stats': {}, 'tasks': []}
+    for name, filename in model_files.items():
+        service['models'][name] = load_served_model(filename)
+        service['queues'][name] = asyncio.Queue()
+        service['stats'][name] = init_stats()
+        service['tasks'].append(asyncio.ensure_future(batch_loop(
+            service['models'][name], service['queues'][name], service['stats'][name], max_batch_size, max_delay)))
+
+    async def on_connect(reader, writer):
+        await handle_connection(service, reader, writer)
+
+    if unix_path is not None:
+        service['server'] = await asyncio.start_unix_server(on_connect, path=unix_path)
+    else:
+        service['server'] = await asyncio.start_server(on_connect, host, port)
+    return service
+
+
+async def stop_service(service):
+    service['server'].close()
+    await service['server'].wait_closed()
+    for task in service['tasks']:
+        task.cancel()
+    await asyncio.gather(*service['tasks'], return_exceptions=True)
+
+
+async def run_service(model_files, **kwargs):
+    service = await start_service(model_files, **kwargs)
+    async with service['server']:
+        await service['server'].serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='serve saved trees and rule sets')
+    parser.add_argument('models', nargs='+', help='name=filename of a model saved by utils.model_io')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', dest='unix_path', default=None, help='listen on this unix socket instead')
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-delay', type=float, default=0.002, help='seconds a request may wait for its batch')
+    args = parser.parse_args()
+    model_files = dict(item.split('=', 1) for item in args.models)
+    asyncio.run(run_service(model_files, host=args.host, port=args.port, unix_path=args.unix_path,
+                            max_batch_size=args.max_batch_size, max_delay=args.max_delay))
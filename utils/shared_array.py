@@ -0,0 +1,38 @@
+#!/usr/bin/bash python3
+#-*- coding: utf8 -*-
+
+"""
+shared array toolkit
+
+Description: hand NumPy arrays to worker processes through `multiprocessing.shared_memory`
+             1. the owner copies an array into a block with `share_array` and passes the small `spec` on
+             2. a worker maps the same pages with `attach_array(spec)`, nothing is pickled but the spec
+             3. the owner `release_array`s the block once every worker is done,
+                every array viewing a block must be dropped before the block is closed
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def share_array(array):
+    """copy `array` into a new shared memory block, return the block, the shared copy and its spec"""
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    spec = {'name': shm.name, 'shape': array.shape, 'dtype': array.dtype.str}
+    return shm, shared, spec
+
+
+def attach_array(spec):
+    """map the shared block described by `spec`, keep the returned block alive while using the array"""
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    array = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+    return shm, array
+
+
+def release_array(shm):
+    """close and free a block created by `share_array`"""
+    shm.close()
+    shm.unlink()